@@ -3,24 +3,33 @@ import json
 import requests
 import copy
 import calendar
+import io
+import click
 import tendie_dashboard
 import tendie_expenses
 import tendie_budgets
 import tendie_categories
 import tendie_reports
+import tendie_reportworker
 import tendie_account
-
-from flask import Flask, jsonify, redirect, render_template, request, session
+import tendie_cache
+import tendie_rollup
+import tendie_import
+import tendie_export
+import tendie_search
+import tendie_recurring
+import tendie_suggest
+
+from flask import Flask, Response, jsonify, redirect, render_template, request, session
 from flask_session import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
 from tempfile import mkdtemp
 from werkzeug.exceptions import default_exceptions, HTTPException, InternalServerError
 from werkzeug.security import check_password_hash, generate_password_hash
-from datetime import datetime
-from flask_wtf.csrf import CSRFProtect
+from datetime import date, datetime, timedelta
+from flask_wtf.csrf import CSRFProtect, generate_csrf
 
-from helpers import apology, login_required, usd
+from helpers import admin_required, apology, login_required, usd
+from tendie_db import db, getPoolStats, runMigrations
 
 # Configure application
 app = Flask(__name__)
@@ -51,9 +60,83 @@ app.jinja_env.filters["usd"] = usd
 # Enable CSRF protection globally for the Flask app
 csrf = CSRFProtect(app)
 
-# Create engine object to manage connections to DB, and scoped session to separate user interactions with DB
-engine = create_engine(os.getenv("DATABASE_URL"))
-db = scoped_session(sessionmaker(bind=engine))
+
+# Return the scoped session's connection to the shared pool at the end of every request
+@app.teardown_appcontext
+def shutdown_session(exception=None):
+    db.remove()
+
+
+# Apply schema migrations from the 'migrations' directory (run with 'flask migrate-db')
+@app.cli.command("migrate-db")
+def migratedb():
+    """Apply pending DB schema migrations"""
+
+    applied = runMigrations()
+    if applied:
+        for version in applied:
+            print(f"Applied migration {version}")
+    else:
+        print("DB schema is up to date")
+
+
+# Recompute the spending rollup from the expenses table (run with 'flask rebuild-rollup', or 'flask rebuild-rollup --check' to only report drift)
+@app.cli.command("rebuild-rollup")
+@click.option("--user-id", type=int, default=None, help="Only check/rebuild this users rollup")
+@click.option("--check", is_flag=True, help="Report drift between the rollup and expenses without rebuilding")
+def rebuildrollup(user_id, check):
+    """Check the spending rollup for drift and rebuild it"""
+
+    drift = tendie_rollup.checkDrift(user_id)
+    for row in drift:
+        print(f"Drift: user {row['user_id']} {row['year']}-{row['month']} week {row['week']} '{row['category']}'/'{row['payer']}': "
+              f"expected {row['expectedcount']} / {row['expectedamount']}, rollup has {row['rollupcount']} / {row['rollupamount']}")
+    print(f"{len(drift)} rollup rows have drifted")
+
+    if not check:
+        rows = tendie_rollup.rebuild(user_id)
+        print(f"Rebuilt spending rollup ({rows} rows)")
+
+
+# Import a bank statement file for a user from the command line (run with 'flask import-expenses USER_ID PATH')
+@app.cli.command("import-expenses")
+@click.argument("user_id", type=int)
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fileFormat", type=click.Choice(["csv", "ofx", "qif"]), default=None, help="Statement format (defaults to the file extension)")
+@click.option("--category", default=None, help="Category for expenses that don't match one of the users categories")
+@click.option("--duplicates", "duplicateMode", type=click.Choice(["skip", "count", "off"]), default="skip", help="What to do with expenses already in the users history")
+def importstatement(user_id, path, fileFormat, category, duplicateMode):
+    """Import expenses from a CSV/OFX/QIF bank statement"""
+
+    fileFormat = fileFormat or tendie_import.getFileFormat(path)
+    if not fileFormat:
+        raise click.UsageError("Can't tell the statement format from the file extension, use --format")
+
+    with open(path, encoding="utf-8-sig", newline="") as statement:
+        summary = tendie_import.importExpenses(statement, fileFormat, user_id, category, duplicateMode=duplicateMode)
+
+    for error in summary["errors"]:
+        print(error)
+    print(f"Imported {summary['imported']} expenses ({summary['skipped']} skipped, {summary['duplicates']} duplicates in file, {summary['existing']} already in history)")
+
+
+# Write every due occurrence of every users recurring expenses (run with 'flask run-recurring')
+@app.cli.command("run-recurring")
+def runrecurring():
+    """Write due recurring expenses"""
+
+    written = tendie_recurring.materialiseDueExpenses()
+    print(f"Wrote {written} recurring expenses")
+
+
+# Recompute reports queued by writes (run with 'flask report-worker', needs REPORT_WORKER=true in the web processes so they queue jobs)
+@app.cli.command("report-worker")
+@click.option("--once", is_flag=True, help="Exit once the job queue is empty instead of waiting for more jobs")
+def reportworker(once):
+    """Precompute reports after writes"""
+
+    done = tendie_reportworker.runWorker(once)
+    print(f"Recomputed reports for {done} user years")
 
 
 @app.route("/register", methods=["GET", "POST"])
@@ -164,61 +247,11 @@ def index():
     if request.method == "GET":
         # TODO reduce or completely remove the redundant use of javascript code in dashboard.js and reports.js
 
-        # Initialize metrics to None to render the appropriate UX if data does not exist yet for the user
-        expenses_year = None
-        expenses_month = None
-        expenses_week = None
-        expenses_last5 = None
-        spending_week = []
-        spending_month = []
+        # Get the users spend categories and payers (for quick expense modal), todays date, income, expense totals, last 5 expenses, budgets, and weekly/monthly/trends/payers chart data in one DB round trip
+        # (served from the dashboard cache unless the users data changed since their last view)
+        dashboard = tendie_dashboard.getCachedDashboard(session["user_id"])
 
-        # Get the users spend categories (for quick expense modal)
-        categories = tendie_categories.getSpendCategories(session["user_id"])
-
-        # Get the users payers (for quick expense modal)
-        payers = tendie_account.getPayers(session["user_id"])
-
-        # Get todays date (for quick expense modal)
-        date = datetime.today().strftime('%Y-%m-%d')
-
-        # Get the users income
-        income = tendie_account.getIncome(session["user_id"])
-
-        # Get current years total expenses for the user
-        expenses_year = tendie_dashboard.getTotalSpend_Year(session["user_id"])
-
-        # Get current months total expenses for the user
-        expenses_month = tendie_dashboard.getTotalSpend_Month(
-            session["user_id"])
-
-        # Get current week total expenses for the user
-        expenses_week = tendie_dashboard.getTotalSpend_Week(session["user_id"])
-
-        # Get last 5 expenses for the user
-        expenses_last5 = tendie_dashboard.getLastFiveExpenses(
-            session["user_id"])
-
-        # Get every budgets spent/remaining for the user
-        budgets = tendie_dashboard.getBudgets(session["user_id"])
-
-        # Get weekly spending for the user
-        weeks = tendie_dashboard.getLastFourWeekNames()
-        spending_week = tendie_dashboard.getWeeklySpending(
-            weeks, session["user_id"])
-
-        # Get monthly spending for the user (for the current year)
-        spending_month = tendie_dashboard.getMonthlySpending(
-            session["user_id"])
-
-        # Get spending trends for the user
-        spending_trends = tendie_dashboard.getSpendingTrends(
-            session["user_id"])
-
-        # Get payer spending for the user
-        payersChart = tendie_reports.generatePayersReport(session["user_id"])
-
-        return render_template("index.html", categories=categories, payers=payers, date=date, income=income, expenses_year=expenses_year, expenses_month=expenses_month, expenses_week=expenses_week, expenses_last5=expenses_last5,
-                               budgets=budgets, spending_week=spending_week, spending_month=spending_month, spending_trends=spending_trends, payersChart=payersChart)
+        return render_template("index.html", **dashboard)
 
     # User reached route via POST
     else:
@@ -228,8 +261,11 @@ def index():
         # Remove CSRF field from form data before processing
         formData.pop(0)
 
-        # Add expenses to the DB for user
-        expenses = tendie_expenses.addExpenses(formData, session["user_id"])
+        # Add expenses to the DB for user (nothing is added if any expense is invalid)
+        try:
+            expenses = tendie_expenses.addExpenses(formData, session["user_id"])
+        except ValueError as error:
+            return apology(str(error), 400)
 
         # Redirect to results page and render a summary of the submitted expenses
         return render_template("expensed.html", results=expenses)
@@ -256,8 +292,11 @@ def addexpenses():
         # Remove CSRF field from form data before processing
         formData.pop(0)
 
-        # Add expenses to the DB for user
-        expenses = tendie_expenses.addExpenses(formData, session["user_id"])
+        # Add expenses to the DB for user (nothing is added if any expense is invalid)
+        try:
+            expenses = tendie_expenses.addExpenses(formData, session["user_id"])
+        except ValueError as error:
+            return apology(str(error), 400)
 
         # Redirect to results page and render a summary of the submitted expenses
         return render_template("expensed.html", results=expenses)
@@ -276,6 +315,78 @@ def addexpenses():
         return render_template("addexpenses.html", categories=categories, date=date, payers=payers)
 
 
+@app.route("/suggest", methods=["GET"])
+@login_required
+def suggest():
+    """Suggest a category and payer for an expense description (used while the user types)"""
+
+    return jsonify(tendie_suggest.suggest(request.args.get("description", ""), session["user_id"]))
+
+
+@app.route("/importexpenses", methods=["GET", "POST"])
+@login_required
+def importexpenses():
+    """Import expenses from a bank statement"""
+
+    # User reached route via POST
+    if request.method == "POST":
+        statement = request.files.get("statement")
+        if not statement or not statement.filename:
+            return apology("must provide a statement file", 400)
+
+        fileFormat = tendie_import.getFileFormat(statement.filename)
+        if not fileFormat:
+            return apology("statement must be a CSV, OFX, QFX or QIF file", 400)
+
+        # Stream the upload through the import pipeline (decoded line by line, never read into memory at once)
+        # Large uploads are spooled to a SpooledTemporaryFile, which TextIOWrapper can't wrap before Python 3.11, so wrap the file underneath it
+        stream = getattr(statement.stream, "_file", statement.stream)
+        lines = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+        try:
+            duplicateMode = "skip" if request.form.get("skipExisting") else "count"
+            summary = tendie_import.importExpenses(lines, fileFormat, session["user_id"], request.form.get("category"), duplicateMode=duplicateMode)
+        except ValueError as error:
+            return apology(str(error), 400)
+
+        # Render a summary of the import
+        return render_template("importexpenses.html", summary=summary)
+
+    # User reached route via GET
+    else:
+        # Get the users spend categories
+        categories = tendie_categories.getSpendCategories(session["user_id"])
+
+        return render_template("importexpenses.html", categories=categories)
+
+
+@app.route("/recurringexpenses", methods=["GET", "POST"])
+@login_required
+def recurringexpenses():
+    """Show, add, or stop the users recurring expenses"""
+
+    # User reached route via POST
+    if request.method == "POST":
+        try:
+            if "btnDeleteRecurring" in request.form:
+                tendie_recurring.deleteRecurringExpense(int(request.form.get("recurringID")), session["user_id"])
+            else:
+                tendie_recurring.addRecurringExpense(request.form, session["user_id"])
+        except ValueError as error:
+            return apology(str(error), 400)
+
+        return redirect("/recurringexpenses")
+
+    # User reached route via GET
+    else:
+        # Get the users recurring expenses, spend categories and payers
+        recurring = tendie_recurring.getRecurringExpenses(session["user_id"])
+        categories = tendie_categories.getSpendCategories(session["user_id"])
+        payers = tendie_account.getPayers(session["user_id"])
+        date = datetime.today().strftime('%Y-%m-%d')
+
+        return render_template("recurringexpenses.html", recurring=recurring, categories=categories, payers=payers, date=date, frequencies=tendie_recurring.FREQUENCIES)
+
+
 @app.route("/expensehistory", methods=["GET", "POST"])
 @login_required
 def expensehistory():
@@ -283,8 +394,8 @@ def expensehistory():
 
     # User reached route via GET
     if request.method == "GET":
-        # Get all of the users expense history ordered by submission time
-        history = tendie_expenses.getHistory(session["user_id"])
+        # Only check if the user has expenses, the table loads its rows one page at a time from /expensehistory/data
+        hasExpenses = tendie_expenses.hasExpenses(session["user_id"])
 
         # Get the users spend categories
         categories = tendie_categories.getSpendCategories(session["user_id"])
@@ -292,7 +403,7 @@ def expensehistory():
         # Get the users payers (for modal)
         payers = tendie_account.getPayers(session["user_id"])
 
-        return render_template("expensehistory.html", history=history, categories=categories, payers=payers, isDeleteAlert=False)
+        return render_template("expensehistory.html", hasExpenses=hasExpenses, categories=categories, payers=payers, isDeleteAlert=False)
 
     # User reached route via POST
     else:
@@ -315,6 +426,10 @@ def expensehistory():
         if oldExpense["id"] == None:
             return apology("The expense record you're trying to update doesn't exist")
 
+        # Make sure the expense hasn't been changed (e.g. in another tab) since the user opened it
+        if oldExpense["version"] != oldExpense["formVersion"]:
+            return apology("This expense was changed since you opened it. Reload your expense history and try again", 409)
+
         # Delete the existing expense record
         if userHasSelected_deleteExpense == True:
 
@@ -324,18 +439,21 @@ def expensehistory():
             if not deleted:
                 return apology("The expense was unable to be deleted")
 
-            # Get the users expense history, spend categories, payers, and then render the history page w/ delete alert
-            history = tendie_expenses.getHistory(session["user_id"])
+            # Check if the user has expenses left, get their spend categories, payers, and then render the history page w/ delete alert
+            hasExpenses = tendie_expenses.hasExpenses(session["user_id"])
             categories = tendie_categories.getSpendCategories(
                 session["user_id"])
             payers = tendie_account.getPayers(session["user_id"])
-            return render_template("expensehistory.html", history=history, categories=categories, payers=payers, isDeleteAlert=True)
+            return render_template("expensehistory.html", hasExpenses=hasExpenses, categories=categories, payers=payers, isDeleteAlert=True)
 
         # Update the existing expense record
         else:
             # Update the old record with new details from the form
-            expensed = tendie_expenses.updateExpense(
-                oldExpense, request.form, session["user_id"])
+            try:
+                expensed = tendie_expenses.updateExpense(
+                    oldExpense, request.form, session["user_id"])
+            except ValueError as error:
+                return apology(str(error), 400)
             if not expensed:
                 return apology("The expense was unable to be updated")
 
@@ -343,6 +461,67 @@ def expensehistory():
             return render_template("expensed.html", results=expensed)
 
 
+@app.route("/expensehistory/data", methods=["GET"])
+@login_required
+def expensehistorydata():
+    """Get one page of the users expense history (DataTables server-side processing)"""
+
+    try:
+        page = tendie_expenses.getHistoryPage(request.args, session["user_id"])
+    except ValueError:
+        return jsonify({"error": "invalid expense history request"}), 400
+
+    return jsonify(page)
+
+
+@app.route("/searchexpenses", methods=["GET"])
+@login_required
+def searchexpenses():
+    """Search the users expense descriptions (ranked and paginated)"""
+
+    try:
+        search = tendie_search.searchExpenses(request.args, session["user_id"])
+    except ValueError:
+        return jsonify({"error": "invalid search request"}), 400
+
+    return jsonify(search)
+
+
+@app.route("/bulkexpenses", methods=["POST"])
+@login_required
+def bulkexpenses():
+    """Change or delete many expenses at once (selected by ID and/or the expense history filters)"""
+
+    try:
+        filters = tendie_expenses.getExpenseFilters(request.form)
+        affected = tendie_expenses.bulkUpdateExpenses(request.form.get("action"), request.form.get("value"), filters, session["user_id"],
+                                                      allExpenses=request.form.get("all") == "true")
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    return jsonify({"affected": affected})
+
+
+@app.route("/exportexpenses/<fileformat>", methods=["GET"])
+@login_required
+def exportexpenses(fileformat):
+    """Download the users expense history (optionally filtered by date range, category and payer)"""
+
+    if fileformat not in tendie_export.EXPORT_FORMATS:
+        return apology("export format must be csv or jsonl", 400)
+
+    try:
+        filters = tendie_expenses.getExpenseFilters(request.args)
+    except ValueError:
+        return apology("start and end dates must be in YYYY-MM-DD format", 400)
+
+    # Stream the file to the client as it's generated (rows are read from a server-side cursor while the response is sent)
+    rows = tendie_export.streamExpenses(filters, session["user_id"])
+    headers = {"Content-Disposition": f"attachment; filename=expenses.{fileformat}"}
+
+    return Response(tendie_export.generateExport(fileformat, rows), mimetype=tendie_export.EXPORT_FORMATS[fileformat], headers=headers)
+
+
 @app.route("/budgets", methods=["GET", "POST"])
 @app.route("/budgets/<int:year>", methods=["GET"])
 @login_required
@@ -684,7 +863,7 @@ def budgetsreport(year=None):
         year = datetime.now().year
 
     # Generate a data structure that combines the users budgets and the expenses that have categories which match budgets
-    budgets = tendie_reports.generateBudgetsReport(session["user_id"], year)
+    budgets = tendie_reports.getCachedReport("budgets", session["user_id"], year)
 
     return render_template("budgetsreport.html", budgets=budgets, year=year)
 
@@ -705,8 +884,8 @@ def monthlyreport(year=None):
         year = datetime.now().year
 
     # Generate a data structure that combines the users monthly spending data needed for chart and table
-    monthlySpending = tendie_reports.generateMonthlyReport(
-        session["user_id"], year)
+    monthlySpending = tendie_reports.getCachedReport(
+        "monthly", session["user_id"], year)
 
     return render_template("monthlyreport.html", monthlySpending=monthlySpending, year=year)
 
@@ -727,8 +906,8 @@ def spendingreport(year=None):
         year = datetime.now().year
 
     # Generate a data structure that combines the users all-time spending data for chart and table
-    spendingReport = tendie_reports.generateSpendingTrendsReport(
-        session["user_id"], year)
+    spendingReport = tendie_reports.getCachedReport(
+        "spendingtrends", session["user_id"], year)
 
     return render_template("spendingreport.html", spending_trends_chart=spendingReport["chart"], spending_trends_table=spendingReport["table"], categories=spendingReport["categories"], year=year)
 
@@ -749,12 +928,89 @@ def payersreport(year=None):
         year = datetime.now().year
 
     # Generate a data structure that combines the users payers and expense data for chart and table
-    payersReport = tendie_reports.generatePayersReport(
-        session["user_id"], year)
+    payersReport = tendie_reports.getCachedReport(
+        "payers", session["user_id"], year)
 
     return render_template("payersreport.html", payers=payersReport, year=year)
 
 
+@app.route("/comparereport", methods=["GET"])
+@login_required
+def comparereport():
+    """Compare spending across years (year-over-year by default)"""
+
+    # Years to compare from the query string (e.g. ?years=2020&years=2021), defaulting to last year vs this year
+    currentYear = datetime.now().year
+    try:
+        years = sorted(set(int(year) for year in request.args.getlist("years")))
+    except ValueError:
+        return apology("years must be numbers", 400)
+    if not years:
+        years = [currentYear - 1, currentYear]
+    for year in years:
+        if not 2020 <= year <= currentYear:
+            return apology(f"Please select valid years: 2020 through {currentYear}")
+
+    # Generate the comparison of totals, months, categories and payers between the years
+    compareReport = tendie_reports.generateCompareReport(session["user_id"], years)
+
+    return render_template("comparereport.html", compare=compareReport, allYears=list(range(currentYear, 2019, -1)))
+
+
+@app.route("/rangereport", methods=["GET"])
+@login_required
+def rangereport():
+    """View spending totals for any date range grouped by day, week, month, quarter, category or payer"""
+
+    groupBy = request.args.get("group", "month")
+    if groupBy not in tendie_rollup.RANGE_GROUPS:
+        return apology("Please select a valid grouping", 400)
+
+    # Date range from a preset (e.g. ?preset=qtd) or from start/end dates (inclusive), defaulting to year to date
+    today = date.today()
+    preset = request.args.get("preset")
+    if preset in tendie_reports.RANGE_PRESETS:
+        start, end = tendie_reports.RANGE_PRESETS[preset][1](today)
+    elif request.args.get("start") and request.args.get("end"):
+        try:
+            start = date.fromisoformat(request.args.get("start"))
+            end = date.fromisoformat(request.args.get("end")) + timedelta(days=1)
+        except ValueError:
+            return apology("start and end must be dates", 400)
+    else:
+        preset = "ytd"
+        start, end = tendie_reports.RANGE_PRESETS[preset][1](today)
+
+    # Generate the totals and counts per group for the range
+    try:
+        rangeReport = tendie_reports.generateRangeReport(session["user_id"], start, end, groupBy)
+    except ValueError as error:
+        return apology(str(error), 400)
+
+    return render_template("rangereport.html", report=rangeReport, lastDate=end - timedelta(days=1), preset=preset,
+                           presets=tendie_reports.RANGE_PRESETS, groups=list(tendie_rollup.RANGE_GROUPS))
+
+
+@app.route("/duplicatesreport", methods=["GET"])
+@login_required
+def duplicatesreport():
+    """View possible duplicate expenses"""
+
+    # Window for near duplicates: dates within 'days' of each other and amounts within 'cents' of each other
+    try:
+        days = int(request.args.get("days", 3))
+        cents = int(request.args.get("cents", 0))
+    except ValueError:
+        return apology("days and cents must be whole numbers", 400)
+    if not 0 <= days <= 31 or not 0 <= cents <= 10000:
+        return apology("days must be 0 to 31 and cents 0 to 10000", 400)
+
+    # Get pairs of expenses that look like duplicates of each other
+    duplicates = tendie_reports.generateDuplicatesReport(session["user_id"], days, cents)
+
+    return render_template("duplicatesreport.html", duplicates=duplicates, days=days, cents=cents, limit=tendie_reports.DUPLICATES_REPORT_LIMIT)
+
+
 @app.route("/account", methods=["GET", "POST"])
 @login_required
 def updateaccount():
@@ -883,6 +1139,65 @@ def updateaccount():
         return render_template("account.html", username=user["name"], income=user["income"], payers=user["payers"], stats=user["stats"], newIncome=None, addPayer=None, renamedPayer=None, deletedPayer=None, updatedPassword=None)
 
 
+@app.route("/admin/pool", methods=["GET"])
+@login_required
+@admin_required
+def adminpool():
+    """Show live DB connection pool stats for this worker"""
+
+    return jsonify(getPoolStats())
+
+
+@app.route("/admin/cache", methods=["GET"])
+@login_required
+@admin_required
+def admincache():
+    """Show cache hit/miss counters for this worker"""
+
+    return jsonify(tendie_cache.getCacheStats())
+
+
+@app.route("/admin/cache/<name>", methods=["GET"])
+@login_required
+@admin_required
+def admincacheentries(name):
+    """Show the keys and sizes of one of this workers caches"""
+
+    cache = tendie_cache.getCache(name)
+    if cache is None:
+        return apology(f"There's no cache named '{name}'", 404)
+
+    entries = [{"key": str(entry["key"]), "bytes": entry["bytes"]} for entry in cache.inspect()]
+
+    # The flush route is CSRF protected like every other POST, so hand out a token to send with it (csrf_token form field or X-CSRFToken header)
+    return jsonify({"stats": cache.stats(), "entries": entries, "csrfToken": generate_csrf()})
+
+
+@app.route("/admin/cache/<name>/flush", methods=["POST"])
+@login_required
+@admin_required
+def admincacheflush(name):
+    """Flush one of this workers caches (or only one users entries with the 'user' form field). Needs the csrfToken from /admin/cache/<name>"""
+
+    cache = tendie_cache.getCache(name)
+    if cache is None:
+        return apology(f"There's no cache named '{name}'", 404)
+
+    # Every cache is keyed by user (or by a tuple starting with the user)
+    userID = request.form.get("user")
+    if userID:
+        try:
+            userID = int(userID)
+        except ValueError:
+            return apology("user must be a user ID", 400)
+        flushed = cache.removeWhere(lambda key: (key[0] if isinstance(key, tuple) else key) == userID)
+    else:
+        flushed = cache.stats()["entries"]
+        cache.clear()
+
+    return jsonify({"name": name, "flushed": flushed})
+
+
 # Handle errors by rendering apology
 def errorhandler(e):
     """Handle error"""
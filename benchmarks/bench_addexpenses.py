@@ -0,0 +1,41 @@
+# Benchmarks tendie_expenses.insertExpenses (the insert path behind /addexpenses) for 10, 100 and 1,000 row submissions
+# Run from the repo root against a dev DB (uses DATABASE_URL, creates a throwaway user and removes it afterwards): python benchmarks/bench_addexpenses.py
+import time
+
+# common puts the repo root on sys.path for the tendie_* imports below
+from common import createUser, deleteUser
+
+import tendie_expenses
+
+from datetime import date, timedelta
+
+SIZES = [10, 100, 1000]
+ROUNDS = 5
+
+
+def generateExpenses(count):
+    today = date.today()
+
+    return [{"description": f"Bench expense {i}", "category": "Groceries", "date": (today - timedelta(days=i % 365)).isoformat(),
+             "amount": round(1 + (i % 250) * 1.37, 2), "payer": "Self"} for i in range(count)]
+
+
+def main():
+    userID = createUser()
+    try:
+        print(f"{'rows':>6} {'best ms':>10} {'rows/sec':>12}")
+        for size in SIZES:
+            expenses = generateExpenses(size)
+            best = None
+            for _ in range(ROUNDS):
+                start = time.perf_counter()
+                tendie_expenses.insertExpenses(expenses, userID)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{size:>6} {best * 1000:>10.2f} {size / best:>12.0f}")
+    finally:
+        deleteUser(userID)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# Benchmarks tendie_reports.generateBudgetsReport (the query behind /budgetsreport) for a user with 50 budgets and 10,000 expenses
+# Run from the repo root against a dev DB (uses DATABASE_URL, creates a throwaway user and removes it afterwards): python benchmarks/bench_budgetsreport.py
+import time
+
+# common puts the repo root on sys.path for the tendie_* imports below
+from common import createUser, deleteUser
+
+import tendie_expenses
+import tendie_reports
+
+from datetime import date, timedelta
+from sqlalchemy import event
+from tendie_db import db, engine
+
+BUDGETS = 50
+EXPENSES = 10000
+CATEGORIES_PER_BUDGET = 3
+ROUNDS = 5
+
+
+# Create BUDGETS budgets for the year, each with CATEGORIES_PER_BUDGET categories (overlapping between budgets, like real users set them up) and return the category names used
+def createBudgets(userID, year):
+    categories = [tuple(row) for row in db.execute("SELECT id, name FROM categories ORDER BY id").fetchall()]
+    for i in range(BUDGETS):
+        budgetID = db.execute("INSERT INTO budgets (name, year, amount, user_id) VALUES (:name, :year, :amount, :usersID) RETURNING id",
+                              {"name": f"Bench budget {i}", "year": year, "amount": 1000 + i * 10, "usersID": userID}).fetchone()[0]
+        for j in range(CATEGORIES_PER_BUDGET):
+            db.execute("INSERT INTO budgetcategories (budgets_id, category_id, amount) VALUES (:budgetID, :categoryID, 0)",
+                       {"budgetID": budgetID, "categoryID": categories[(i + j) % len(categories)][0]})
+    db.commit()
+
+    return [category[1] for category in categories]
+
+
+def generateExpenses(count, categories, year):
+    start = date(year, 1, 1)
+    days = (min(date.today(), date(year, 12, 31)) - start).days + 1
+
+    return [{"description": f"Bench expense {i}", "category": categories[i % len(categories)], "date": (start + timedelta(days=i % days)).isoformat(),
+             "amount": round(1 + (i % 250) * 1.37, 2), "payer": "Self"} for i in range(count)]
+
+
+def main():
+    year = date.today().year
+    userID = createUser()
+
+    # Count the statements each report runs
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(1))
+
+    try:
+        categories = createBudgets(userID, year)
+        tendie_expenses.insertExpenses(generateExpenses(EXPENSES, categories, year), userID)
+
+        best = None
+        for _ in range(ROUNDS):
+            statements.clear()
+            start = time.perf_counter()
+            report = tendie_reports.generateBudgetsReport(userID, year)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            db.rollback()
+
+        pairs = sum(len(budget["expenses"]) for budget in report)
+        print(f"{BUDGETS} budgets x {EXPENSES} expenses: {len(report)} budgets, {pairs} budget/expense pairs, {len(statements)} queries, best {best * 1000:.2f} ms")
+    finally:
+        deleteUser(userID)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# Fixtures shared by the benchmarks: a throwaway user created for a run and everything it wrote removed afterwards
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime
+from tendie_db import db
+
+# Tables (keyed by user_id) a benchmark user can have rows in, deleted in this order
+USER_TABLES = ["budgets", "expenses", "spendingrollup", "useryearversions", "reportjobs", "reportresults"]
+
+
+# Create a throwaway user and return its ID
+def createUser():
+    now = datetime.now()
+    userID = db.execute("INSERT INTO users (username, hash, registerDate, lastLogin) VALUES (:username, 'x', :now, :now) RETURNING id",
+                        {"username": f"bench-{os.getpid()}-{time.time()}", "now": now}).fetchone()[0]
+    db.commit()
+
+    return userID
+
+
+# Delete the user and everything a benchmark wrote for them
+def deleteUser(userID):
+    db.rollback()
+    db.execute("DELETE FROM budgetcategories WHERE budgets_id IN (SELECT id FROM budgets WHERE user_id = :usersID)", {"usersID": userID})
+    for table in USER_TABLES:
+        db.execute(f"DELETE FROM {table} WHERE user_id = :usersID", {"usersID": userID})
+    db.execute("DELETE FROM users WHERE id = :usersID", {"usersID": userID})
+    db.commit()
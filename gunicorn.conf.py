@@ -0,0 +1,9 @@
+import os
+
+
+# Start the recurring expense scheduler in each worker once it has loaded the app (only serving processes run it, not 'flask' CLI commands)
+# Set RECURRING_SCHEDULER=false to only run due recurring expenses with 'flask run-recurring' instead (e.g. from cron)
+def post_worker_init(worker):
+    if os.getenv("RECURRING_SCHEDULER", "true").lower() in ("1", "true", "yes"):
+        import tendie_recurring
+        tendie_recurring.startScheduler()
@@ -5,6 +5,7 @@ import decimal
 
 from flask import redirect, render_template, request, session
 from functools import wraps
+from datetime import date, timedelta
 
 
 def apology(message, code=400):
@@ -36,6 +37,19 @@ def login_required(f):
     return decorated_function
 
 
+def admin_required(f):
+    """
+    Decorate routes to require an admin user (user IDs listed in the ADMIN_USER_IDS env var, comma separated).
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        adminIDs = [userID.strip() for userID in os.getenv("ADMIN_USER_IDS", "").split(",")]
+        if str(session.get("user_id")) not in adminIDs:
+            return apology("admins only", 403)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
 def usd(value):
     """Format value as USD."""
     return f"${value:,.2f}"
@@ -59,3 +73,14 @@ def convertSQLToDict(listOfRowProxy):
                 row[column] = bytes(row[column])
 
     return rows
+
+
+# Half-open [start, end) date ranges used by expense queries (expensedate >= start AND expensedate < end) so Postgres can use the (user_id, expensedate) index
+def yearRange(year):
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+# Weeks start on Monday (same as Postgres date_trunc('week', ...))
+def weekRange(day):
+    start = day - timedelta(days=day.weekday())
+    return start, start + timedelta(days=7)
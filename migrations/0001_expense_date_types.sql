@@ -0,0 +1,23 @@
+-- Store expense dates as real DATE / TIMESTAMP values instead of TEXT so date predicates can use an index
+-- expensedate was always written as 'YYYY-MM-DD' (HTML date input) and submittime as 'MM/DD/YYYY HH24:MI:SS' (datetime.strftime in Python)
+ALTER TABLE expenses
+	ALTER COLUMN expensedate TYPE DATE USING expensedate::date,
+	ALTER COLUMN submittime TYPE TIMESTAMP USING to_timestamp(submittime, 'MM/DD/YYYY HH24:MI:SS')::timestamp;
+
+-- Dashboard / report predicates are half-open date ranges per user: expensedate >= :start AND expensedate < :end
+CREATE INDEX IF NOT EXISTS expenses_user_id_expensedate_idx ON expenses (user_id, expensedate);
+
+-- Budgets filter a user's expenses by category within a date range
+CREATE INDEX IF NOT EXISTS expenses_user_id_category_expensedate_idx ON expenses (user_id, category, expensedate);
+
+-- Expense history and last five expenses order a user's expenses by id
+CREATE INDEX IF NOT EXISTS expenses_user_id_id_idx ON expenses (user_id, id);
+
+ANALYZE expenses;
+
+-- To compare plans before/after this migration, run the dashboard queries with EXPLAIN (ANALYZE, BUFFERS), e.g.
+--   year:  SELECT SUM(amount) FROM expenses WHERE user_id = 1 AND expensedate >= '2020-01-01' AND expensedate < '2021-01-01';
+--   month: SELECT SUM(amount) FROM expenses WHERE user_id = 1 AND expensedate >= '2020-04-01' AND expensedate < '2020-05-01';
+--   week:  SELECT SUM(amount) FROM expenses WHERE user_id = 1 AND expensedate >= '2020-04-13' AND expensedate < '2020-04-20';
+-- Before: Seq Scan on expenses with Filter: date_part('year', date(expensedate)) = ... (every row is cast)
+-- After:  Index Scan / Bitmap Index Scan using expenses_user_id_expensedate_idx with Index Cond on (user_id, expensedate)
@@ -0,0 +1,23 @@
+-- Per user spending totals by calendar year, month, ISO week, category and payer
+-- Kept current by the expense write paths (see tendie_rollup.py) so dashboard/report totals cost O(categories) instead of O(expenses)
+CREATE TABLE IF NOT EXISTS spendingrollup (
+	user_id	INTEGER NOT NULL,
+	year	INTEGER NOT NULL,
+	month	INTEGER NOT NULL,
+	week	INTEGER NOT NULL,
+	category	TEXT NOT NULL,
+	payer	TEXT NOT NULL,
+	count	INTEGER NOT NULL DEFAULT 0,
+	amount	DOUBLE PRECISION NOT NULL DEFAULT 0,
+	CONSTRAINT spendingrollup_pkey PRIMARY KEY (user_id, year, month, week, category, payer),
+	CONSTRAINT spendingrollup_user_id_fkey FOREIGN KEY (user_id)
+		REFERENCES users (id) MATCH SIMPLE
+		ON UPDATE NO ACTION ON DELETE NO ACTION
+);
+
+-- Seed the rollup from existing expenses
+INSERT INTO spendingrollup (user_id, year, month, week, category, payer, count, amount)
+SELECT user_id, date_part('year', expensedate), date_part('month', expensedate), date_part('week', expensedate), category, payer, COUNT(*), SUM(amount::float8)
+FROM expenses
+WHERE user_id IS NOT NULL
+GROUP BY user_id, date_part('year', expensedate), date_part('month', expensedate), date_part('week', expensedate), category, payer;
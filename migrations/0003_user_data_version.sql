@@ -0,0 +1,3 @@
+-- Per user data version, bumped in the same transaction as every write to the users expenses, budgets, categories, payers or income
+-- In-process caches compare it with the version their entries were computed from, so a write in any gunicorn worker invalidates every worker's cache
+ALTER TABLE users ADD COLUMN IF NOT EXISTS dataversion INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,13 @@
+-- Expense history is paged with keyset pagination: WHERE user_id = :id AND (sort column, id) > (:cursorValue, :cursorID) ORDER BY sort column, id
+-- One index per sortable column so every page (in either direction) is an index range scan of just the rows on that page
+-- The history is sorted by id by default, which uses expenses_user_id_id_idx from 0001
+CREATE INDEX IF NOT EXISTS expenses_user_id_expensedate_id_idx ON expenses (user_id, expensedate, id);
+CREATE INDEX IF NOT EXISTS expenses_user_id_description_id_idx ON expenses (user_id, description, id);
+CREATE INDEX IF NOT EXISTS expenses_user_id_category_id_idx ON expenses (user_id, category, id);
+CREATE INDEX IF NOT EXISTS expenses_user_id_payer_id_idx ON expenses (user_id, payer, id);
+CREATE INDEX IF NOT EXISTS expenses_user_id_amount_id_idx ON expenses (user_id, amount, id);
+
+-- (user_id, expensedate, id) covers every query the (user_id, expensedate) index was used for
+DROP INDEX IF EXISTS expenses_user_id_expensedate_idx;
+
+ANALYZE expenses;
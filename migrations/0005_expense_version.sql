@@ -0,0 +1,2 @@
+-- Row version for optimistic concurrency: updates/deletes only apply to the version the user was editing (WHERE id = :id AND version = :version) and updates bump it
+ALTER TABLE expenses ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
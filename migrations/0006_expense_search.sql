@@ -0,0 +1,13 @@
+-- Indexes for searching expense descriptions (see tendie_search.py)
+-- btree_gin lets user_id share a GIN index with the search columns so a search only touches the searching users matches
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+-- Full-text (word, prefix and phrase) queries: to_tsvector('simple', description) @@ to_tsquery('simple', ...)
+-- 'simple' doesn't stem or drop stop words, which suits short merchant/item names better than a language dictionary
+CREATE INDEX IF NOT EXISTS expenses_user_id_description_fts_idx ON expenses USING GIN (user_id, to_tsvector('simple', description));
+
+-- Fuzzy (typo tolerant) queries: :text <% description, also used by ILIKE '%...%' in the expense history search box
+CREATE INDEX IF NOT EXISTS expenses_user_id_description_trgm_idx ON expenses USING GIN (user_id, description gin_trgm_ops);
+
+ANALYZE expenses;
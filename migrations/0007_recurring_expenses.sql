@@ -0,0 +1,34 @@
+-- Recurring expense definitions: every 'interval' days/weeks/months/years from startdate (until enddate, if set)
+-- nextdate is the first occurrence that hasn't been written to expenses yet (see tendie_recurring.py)
+CREATE TABLE IF NOT EXISTS recurringexpenses (
+	id	SERIAL PRIMARY KEY,
+	user_id	INTEGER NOT NULL,
+	description	TEXT NOT NULL,
+	category	TEXT NOT NULL,
+	amount	REAL NOT NULL,
+	payer	TEXT NOT NULL,
+	frequency	TEXT NOT NULL CHECK (frequency IN ('daily', 'weekly', 'monthly', 'yearly')),
+	interval	INTEGER NOT NULL DEFAULT 1 CHECK (interval > 0),
+	startdate	DATE NOT NULL,
+	enddate	DATE,
+	nextdate	DATE NOT NULL,
+	active	BOOLEAN NOT NULL DEFAULT true,
+	CONSTRAINT recurringexpenses_user_id_fkey FOREIGN KEY (user_id)
+		REFERENCES users (id) MATCH SIMPLE
+		ON UPDATE NO ACTION ON DELETE NO ACTION
+);
+
+-- The scheduler only ever looks for active definitions that are due
+CREATE INDEX IF NOT EXISTS recurringexpenses_nextdate_idx ON recurringexpenses (nextdate) WHERE active;
+CREATE INDEX IF NOT EXISTS recurringexpenses_user_id_idx ON recurringexpenses (user_id);
+
+-- Expenses written by the scheduler remember their definition. One expense per definition and date, so materialising an occurrence twice is a no-op
+ALTER TABLE expenses ADD COLUMN IF NOT EXISTS recurring_id INTEGER;
+CREATE UNIQUE INDEX IF NOT EXISTS expenses_recurring_id_expensedate_idx ON expenses (recurring_id, expensedate) WHERE recurring_id IS NOT NULL;
+
+-- Time-limited leases so only one process (of all gunicorn workers/hosts) runs a scheduled job at a time
+CREATE TABLE IF NOT EXISTS schedulerleases (
+	name	TEXT PRIMARY KEY,
+	owner	TEXT NOT NULL,
+	expires	TIMESTAMP NOT NULL
+);
@@ -0,0 +1,24 @@
+-- Duplicate detection (see tendie_expenses.findDuplicates and tendie_reports.generateDuplicatesReport)
+-- Description key: lowercase letters/digits only, so 'Coffee - Joe''s' and 'coffee joes' are the same description
+CREATE OR REPLACE FUNCTION expense_description_key(description TEXT) RETURNS TEXT AS $$
+	SELECT lower(regexp_replace(description, '[^[:alnum:]]+', '', 'g'))
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Fingerprint: date (as days since 2000-01-01), amount in cents and description key. Same fingerprint (per user) = same expense
+-- The REAL amount goes through float8 first: REAL -> numeric keeps only 6 significant digits, so amounts of $10,000+ would lose their cents
+CREATE OR REPLACE FUNCTION expense_fingerprint(expensedate DATE, amount REAL, description TEXT) RETURNS TEXT AS $$
+	SELECT md5((expensedate - DATE '2000-01-01')::text || ':' || round(amount::float8::numeric * 100)::text || ':' || expense_description_key(description))
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Generated columns are kept current by every write path (form, import COPY, recurring expenses, bulk edits) without any code changes
+ALTER TABLE expenses
+	ADD COLUMN IF NOT EXISTS descriptionkey TEXT GENERATED ALWAYS AS (expense_description_key(description)) STORED,
+	ADD COLUMN IF NOT EXISTS fingerprint TEXT GENERATED ALWAYS AS (expense_fingerprint(expensedate, amount, description)) STORED;
+
+-- Exact duplicates: one index probe per new expense
+CREATE INDEX IF NOT EXISTS expenses_user_id_fingerprint_idx ON expenses (user_id, fingerprint);
+
+-- Near duplicates: same description key within a few days of each other
+CREATE INDEX IF NOT EXISTS expenses_user_id_descriptionkey_expensedate_idx ON expenses (user_id, descriptionkey, expensedate);
+
+ANALYZE expenses;
@@ -0,0 +1,14 @@
+-- Per (user, year) data version, bumped by the expense write paths for every year they touch (see tendie_rollup.applyExpenses)
+-- The report cache keys closed years by it, so a write to this years expenses doesn't invalidate the reports of earlier years
+CREATE TABLE IF NOT EXISTS useryearversions (
+	user_id	INTEGER NOT NULL,
+	year	INTEGER NOT NULL,
+	version	INTEGER NOT NULL DEFAULT 0,
+	CONSTRAINT useryearversions_pkey PRIMARY KEY (user_id, year),
+	CONSTRAINT useryearversions_user_id_fkey FOREIGN KEY (user_id)
+		REFERENCES users (id) MATCH SIMPLE
+		ON UPDATE NO ACTION ON DELETE NO ACTION
+);
+
+-- Per user report version for writes that change every years reports (budgets, category/payer changes and renames)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS reportversion INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,29 @@
+-- Queue of (user, year) report recomputes for the report worker ('flask report-worker')
+-- One row per user and year: writes upsert it, so any number of writes before the worker gets to it (e.g. an import) coalesce into one recompute
+CREATE TABLE IF NOT EXISTS reportjobs (
+	user_id	INTEGER NOT NULL,
+	year	INTEGER NOT NULL,
+	requestedtime	TIMESTAMP NOT NULL DEFAULT clock_timestamp(),
+	claimedtime	TIMESTAMP,
+	CONSTRAINT reportjobs_pkey PRIMARY KEY (user_id, year),
+	CONSTRAINT reportjobs_user_id_fkey FOREIGN KEY (user_id)
+		REFERENCES users (id) MATCH SIMPLE
+		ON UPDATE NO ACTION ON DELETE NO ACTION
+);
+
+CREATE INDEX IF NOT EXISTS reportjobs_requestedtime_idx ON reportjobs (requestedtime);
+
+-- Reports precomputed by the worker (as JSON), valid for the users report/year versions they were computed from
+CREATE TABLE IF NOT EXISTS reportresults (
+	user_id	INTEGER NOT NULL,
+	report	TEXT NOT NULL,
+	year	INTEGER NOT NULL,
+	reportversion	INTEGER NOT NULL,
+	yearversion	INTEGER NOT NULL,
+	result	JSONB NOT NULL,
+	computedtime	TIMESTAMP NOT NULL DEFAULT now(),
+	CONSTRAINT reportresults_pkey PRIMARY KEY (user_id, report, year),
+	CONSTRAINT reportresults_user_id_fkey FOREIGN KEY (user_id)
+		REFERENCES users (id) MATCH SIMPLE
+		ON UPDATE NO ACTION ON DELETE NO ACTION
+);
@@ -0,0 +1,4 @@
+-- Covering index for the payers spending query (tendie_dashboard.PAYERS_SPENDING_SQL): an index-only scan of one users year grouped by payer
+CREATE INDEX IF NOT EXISTS spendingrollup_user_id_year_payer_idx ON spendingrollup (user_id, year, payer) INCLUDE (amount);
+
+ANALYZE spendingrollup;
@@ -134,4 +134,9 @@ function updateRowButton() {
         // Disable the add row button
         document.getElementById("btnNewRow").disabled = true;
     }
-}
\ No newline at end of file
+}
+// Suggest a category and payer from the description while the user types (see suggest.js)
+watchSuggestions("textarea[name^='description.']", "select[name^='category.'], select[name^='payer.']", function (description) {
+    let row = description.closest('tr');
+    return { category: row.find("select[name^='category.']"), payer: row.find("select[name^='payer.']") };
+});
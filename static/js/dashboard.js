@@ -323,4 +323,8 @@ function loadPayersSpendingChart(payersSpending) {
         });
 
     }
-}
\ No newline at end of file
+}
+// Suggest a category and payer in the quick expense form from the description while the user types (see suggest.js)
+watchSuggestions('#quickExpense #description', '#quickExpense #category, #quickExpense #payer', function (description) {
+    return { category: $('#quickExpense #category'), payer: $('#quickExpense #payer') };
+});
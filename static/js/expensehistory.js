@@ -1,17 +1,91 @@
 // SUMMARY: this file handles all of the functionality to view, update, or delete a users expense history on the 'Expense History' page of Tendie Tracker.
 
-//Data Table
+//Data Table (server-side processing: rows are loaded from /expensehistory/data one page at a time, see historytable.js)
 $(document).ready(function () {
-    $('#expenses').DataTable({
+    var table = $('#expenses').DataTable({
         "pagingType": "full_numbers",
         "order": [[0, "desc"]],
-        dom: 'Bfrtip',
-        buttons: [
-            'copy', 'csv', 'excel'
+        "serverSide": true,
+        "processing": true,
+        "searchDelay": 400,
+        "ajax": expenseHistoryAjax(function (data) {
+            data.startDate = $('#filterStartDate').val();
+            data.endDate = $('#filterEndDate').val();
+            data.category = $('#filterCategory').val();
+            data.payer = $('#filterPayer').val();
+        }),
+        "columns": [
+            { "data": "id" },
+            { "data": "description", "render": renderDescription },
+            { "data": "category", "render": $.fn.dataTable.render.text() },
+            { "data": "date" },
+            { "data": "payer", "render": $.fn.dataTable.render.text() },
+            { "data": "amount", "render": $.fn.dataTable.render.number(',', '.', 2, '$') }
         ]
     });
+
+    // Reload the table from the first page when a filter changes
+    $('.expenseFilter').change(function () {
+        table.ajax.reload();
+    });
+
+    // Show the value input for the selected bulk action
+    $('#bulkAction').change(function () {
+        var action = $(this).val();
+        $('.bulkValue').each(function () {
+            $(this).toggle($(this).data('action') == action);
+        });
+    });
+
+    // Apply a bulk action to every expense matching the filters and search (one request, one transaction on the server)
+    $('#bulkForm').submit(function (event) {
+        event.preventDefault();
+        var action = $('#bulkAction').val();
+        var matching = table.page.info().recordsDisplay;
+        var filtered = $('#filterStartDate').val() || $('#filterEndDate').val() || $('#filterCategory').val() || $('#filterPayer').val() || table.search();
+        if (!matching || !confirm($('#bulkAction option:selected').text() + ' ' + (action == 'delete' ? '' : $('.bulkValue:visible').val() + ' ') + 'for ' + (filtered ? '' : 'ALL ') + matching + ' expenses?')) {
+            return;
+        }
+
+        var data = {
+            csrf_token: $('#bulkForm input[name=csrf_token]').val(),
+            action: action,
+            value: $('.bulkValue:visible').val(),
+            startDate: $('#filterStartDate').val(),
+            endDate: $('#filterEndDate').val(),
+            category: $('#filterCategory').val(),
+            payer: $('#filterPayer').val(),
+            search: table.search(),
+            all: filtered ? 'false' : 'true'
+        };
+        $.post('/bulkexpenses', data)
+            .done(function (result) {
+                alert(result.affected + ' expenses updated');
+                table.ajax.reload();
+            })
+            .fail(function (response) {
+                alert(response.responseJSON ? response.responseJSON.error : 'The expenses were unable to be updated');
+            });
+    });
 });
 
+// Render the description as the link that opens the update modal (with the expense details in data-* attributes for the modal)
+function renderDescription(description, type, expense) {
+    if (type != 'display') {
+        return description;
+    }
+    var link = $('<a href="#" data-toggle="modal" data-target="#updateModal"></a>')
+        .attr('data-description', expense.description)
+        .attr('data-category', expense.category)
+        .attr('data-date', expense.date)
+        .attr('data-payer', expense.payer)
+        .attr('data-amount', expense.amount)
+        .attr('data-id', expense.id)
+        .attr('data-version', expense.version)
+        .text(expense.description);
+    return link.prop('outerHTML');
+}
+
 // Delete expense UX functionality
 var expenseDetailsBody;
 var saveButton = $('#btnSave');
@@ -56,16 +130,13 @@ $('#updateModal').on('show.bs.modal', function (event) {
     var date = button.data('date') // Extract info from data-* attributes
     var payer = button.data('payer') // Extract info from data-* attributes
     var amount = button.data('amount') // Extract info from data-* attributes
-    var submitTime = button.data('submittime')
+    var expenseID = button.data('id')
+    var version = button.data('version')
     var modal = $(this)
     modal.find('.modal-title').text("Update Expense Record")
-    // Fields for current expense values
-    modal.find('#oldDescription').val(description)
-    modal.find('#oldCategory').val(category)
-    modal.find('#oldDate').val(date)
-    modal.find('#oldPayer').val(payer)
-    modal.find('#oldAmount').val(amount)
-    modal.find('#submitTime').val(submitTime)
+    // Fields identifying the expense (and the version of it being edited)
+    modal.find('#expenseID').val(expenseID)
+    modal.find('#version').val(version)
     // Fields for updating the expense
     modal.find('#description').val(description)
     modal.find('#category').val(category)
@@ -0,0 +1,37 @@
+// SUMMARY: this file loads expense tables one page at a time from /expensehistory/data (DataTables server-side processing). It's shared by the 'Expense History' page and the monthly report of Tendie Tracker.
+
+// Build the "ajax" option of an expense table. addFilters(data) adds the tables filters (startDate, endDate, category, payer) to each request
+// Keyset pagination: the server returns a cursor for the page after each page it sends. Cursors are remembered by row offset so paging forward/back seeks straight to the page instead of using OFFSET.
+// Cursors are only valid for one sort order + search + filters, so they're cleared whenever those change.
+function expenseHistoryAjax(addFilters) {
+    var cursors = {};
+    var cursorsKey = null;
+    var pageEnds = {};
+
+    return {
+        "url": "/expensehistory/data",
+        "data": function (data) {
+            addFilters(data);
+
+            var key = JSON.stringify([data.order, data.search.value, data.startDate, data.endDate, data.category, data.payer, data.length]);
+            if (key != cursorsKey) {
+                cursors = {};
+                cursorsKey = key;
+            }
+            if (cursors[data.start]) {
+                data.cursor = cursors[data.start];
+            }
+
+            // Remember where this request's page ends, so the cursor in its response is stored for the page after it
+            pageEnds[data.draw] = { key: key, offset: data.start + data.length };
+        },
+        "dataSrc": function (json) {
+            var pageEnd = pageEnds[json.draw];
+            delete pageEnds[json.draw];
+            if (json.cursor && pageEnd && pageEnd.key == cursorsKey) {
+                cursors[pageEnd.offset] = json.cursor;
+            }
+            return json.data;
+        }
+    };
+}
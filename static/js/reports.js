@@ -167,6 +167,8 @@ function loadMonthlySpendingChart(monthlySpendingChart) {
     }
 }
 
+// The years expenses are loaded from /expensehistory/data a page at a time (DataTables server-side processing), filtered to the years dates
+// Keyset cursors are remembered by row offset like on the Expense History page (see historytable.js), so paging through a large year stays fast
 function loadMonthlySpendingTable(monthlySpendingTable) {
     if (monthlySpendingTable == null) {
         return;
@@ -175,12 +177,20 @@ function loadMonthlySpendingTable(monthlySpendingTable) {
         $('#monthlyExpenses').DataTable({
             "pagingType": "full_numbers",
             "order": [[0, "desc"]],
-            "scrollY": "300px",
-            "scrollCollapse": true,
-            "paging": false,
-            dom: 'Bfrtip',
-            buttons: [
-                'copy', 'csv', 'excel'
+            "serverSide": true,
+            "processing": true,
+            "searchDelay": 400,
+            "ajax": expenseHistoryAjax(function (data) {
+                data.startDate = monthlySpendingTable.startDate;
+                data.endDate = monthlySpendingTable.endDate;
+            }),
+            "columns": [
+                { "data": "id" },
+                { "data": "description", "render": $.fn.dataTable.render.text() },
+                { "data": "category", "render": $.fn.dataTable.render.text() },
+                { "data": "date" },
+                { "data": "payer", "render": $.fn.dataTable.render.text() },
+                { "data": "amount", "render": $.fn.dataTable.render.number(',', '.', 2, '$') }
             ]
         });
     }
@@ -333,4 +343,56 @@ function loadPayersSpendingChart(payersSpending) {
         });
 
     }
-}
\ No newline at end of file
+}
+// Loads *year comparison* data from Flask/Jinja that is passed from the request
+function loadCompareData(compareData) {
+    compare = JSON.parse(compareData);
+    loadCompareChart(compare);
+}
+
+// Monthly spending with one bar per compared year
+function loadCompareChart(compare) {
+    let colors = ['rgba(240, 173, 78, 1)', 'rgba(2, 184, 117, 1)', 'rgba(91, 192, 222, 1)', 'rgba(217, 83, 79, 1)', 'rgba(86, 61, 124, 1)', 'rgba(41, 43, 44, 1)'];
+    let months = [];
+    for (let i = 0; i < compare.months.length; i++) {
+        months[i] = compare.months[i].name;
+    }
+
+    let datasets = [];
+    for (let y = 0; y < compare.years.length; y++) {
+        let amounts = [];
+        for (let i = 0; i < compare.months.length; i++) {
+            amounts[i] = (Math.round(compare.months[i].amounts[y] * 100) / 100);
+        }
+        datasets[y] = {
+            label: String(compare.years[y]),
+            data: amounts,
+            backgroundColor: colors[y % colors.length],
+            borderWidth: 0
+        };
+    }
+
+    let chartElement = document.getElementById('compareChart').getContext('2d');
+    let compareChart = new Chart(chartElement, {
+        type: 'bar',
+        data: {
+            labels: months,
+            datasets: datasets
+        },
+        options: {
+            title: {
+                display: true,
+                text: 'Total spending per month'
+            },
+            responsive: true,
+            maintainAspectRatio: false,
+            scales: {
+                yAxes: [{
+                    ticks: {
+                        beginAtZero: true
+                    }
+                }]
+            }
+        }
+    });
+}
@@ -0,0 +1,32 @@
+// SUMMARY: this file suggests a category and payer from an expense's description while the user types. It's shared by the 'Dashboard' quick expense form and the 'Add Expenses' page of Tendie Tracker.
+
+// Watch the description inputs matching 'descriptions' and fill in the category/payer selects that go with each one (getSelects returns {category, payer} for a description input)
+// Only selects the user hasn't picked a value in themselves are filled in (picks in the selects matching 'selects' are remembered)
+function watchSuggestions(descriptions, selects, getSelects) {
+    var suggestTimer;
+    $(document).on('input', descriptions, function () {
+        let targets = getSelects($(this));
+        let description = $(this).val();
+        clearTimeout(suggestTimer);
+        suggestTimer = setTimeout(function () {
+            $.getJSON('/suggest', { description: description }, function (suggestion) {
+                applySuggestion(targets.category, suggestion.category);
+                applySuggestion(targets.payer, suggestion.payer);
+            });
+        }, 150);
+    });
+
+    // Remember when the user picks a category/payer so suggestions don't overwrite it
+    $(document).on('change', selects, function (event) {
+        if (event.originalEvent) {
+            $(this).data('userpicked', true);
+        }
+    });
+}
+
+// Select the suggested value if it's one of the options and the user hasn't picked a value
+function applySuggestion(select, value) {
+    if (value && !select.data('userpicked') && select.find("option").filter(function () { return this.value == value; }).length) {
+        select.val(value);
+    }
+}
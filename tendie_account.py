@@ -1,15 +1,12 @@
-import os
+import tendie_cache
+import tendie_rollup
+import tendie_suggest
 
 from flask import request, session
 from flask_session import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
 from werkzeug.security import check_password_hash, generate_password_hash
 from helpers import convertSQLToDict
-
-# Create engine object to manage connections to DB, and scoped session to separate user interactions with DB
-engine = create_engine(os.getenv("DATABASE_URL"))
-db = scoped_session(sessionmaker(bind=engine))
+from tendie_db import db
 
 
 # Get the users account name
@@ -32,6 +29,7 @@ def getIncome(userID):
 def updateIncome(income, userID):
     rows = db.execute("UPDATE users SET income = :newIncome WHERE id = :usersID",
                       {"newIncome": income, "usersID": userID}).rowcount
+    tendie_cache.bumpDataVersion(userID)
     db.commit()
 
     # Return an error message if the record could not be updated
@@ -66,6 +64,8 @@ def addPayer(name, userID):
         # Insert new payer into DB
         row = db.execute("INSERT INTO payers (user_id, name) VALUES (:usersID, :name)",
                          {"usersID": userID, "name": name}).rowcount
+        tendie_cache.bumpDataVersion(userID)
+        tendie_cache.bumpReportVersion(userID)
         db.commit()
 
         return row
@@ -84,13 +84,20 @@ def renamePayer(existingName, newName, userID):
     # Update existing *expense* records to usse the new name
     db.execute("UPDATE expenses SET payer = :name WHERE user_id = :usersID AND payer = :oldName",
                {"name": newName, "usersID": userID, "oldName": existingName})
+
+    # Rename the payer in the users spending rollup (same transaction)
+    tendie_rollup.renameKey("payer", existingName, newName, userID)
     db.commit()
 
     # Update the existing *payer* record with the new payers name
     rows = db.execute(
         "UPDATE payers SET name = :name WHERE user_id = :usersID AND name = :oldName", {"name": newName, "usersID": userID, "oldName": existingName}).rowcount
+    tendie_cache.bumpDataVersion(userID)
     db.commit()
 
+    # Suggest the payer by its new name
+    tendie_suggest.forgetModel(userID)
+
     # Return an error message if the record could not be updated
     if rows != 1:
         return {"apology": "Sorry, Rename Payer is having problems. Try again!"}
@@ -107,8 +114,13 @@ def deletePayer(name, userID):
     # Delete the record
     rows = db.execute("DELETE FROM payers WHERE name = :name AND user_id = :usersID",
                       {"name": name, "usersID": userID}).rowcount
+    tendie_cache.bumpDataVersion(userID)
+    tendie_cache.bumpReportVersion(userID)
     db.commit()
 
+    # Stop suggesting the deleted payer
+    tendie_suggest.forgetModel(userID)
+
     # Return an error message if the record could not be deleted
     if rows != 1:
         return {"apology": "Sorry, Delete payer isn't working for some reason. Try again!"}
@@ -1,17 +1,12 @@
-import os
+import tendie_cache
 import re
 import tendie_categories
 
 from flask import request, session
 from flask_session import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
 from datetime import datetime
 from helpers import convertSQLToDict
-
-# Create engine object to manage connections to DB, and scoped session to separate user interactions with DB
-engine = create_engine(os.getenv("DATABASE_URL"))
-db = scoped_session(sessionmaker(bind=engine))
+from tendie_db import db
 
 
 # Get the users budgets
@@ -140,6 +135,11 @@ def createBudget(budget, userID):
     # Insert a record for each category in the new budget
     addCategory(newBudgetID, categoryIDS)
 
+    # Invalidate the users cached dashboard/report data now that the budget is complete
+    tendie_cache.bumpDataVersion(userID)
+    tendie_cache.bumpReportVersion(userID)
+    db.commit()
+
     return budget
 
 
@@ -180,6 +180,11 @@ def updateBudget(oldBudgetName, budget, userID):
     # Insert a record for each category in the new budget
     addCategory(oldBudgetID, categoryIDS)
 
+    # Invalidate the users cached dashboard/report data now that the budget is complete
+    tendie_cache.bumpDataVersion(userID)
+    tendie_cache.bumpReportVersion(userID)
+    db.commit()
+
     return budget
 
 
@@ -214,9 +219,11 @@ def deleteBudget(budgetName, userID):
                    {"budgetID": budgetID})
         db.commit()
 
-        # Delete the budget
+        # Delete the budget (and invalidate the users cached dashboard/report data)
         db.execute("DELETE FROM budgets WHERE id = :budgetID",
                    {"budgetID": budgetID})
+        tendie_cache.bumpDataVersion(userID)
+        tendie_cache.bumpReportVersion(userID)
         db.commit()
 
         return budgetName
@@ -0,0 +1,182 @@
+import os
+import pickle
+import threading
+
+from collections import OrderedDict
+from datetime import datetime
+from tendie_db import db
+
+
+# Thread-safe LRU cache bounded by the (pickled) size of its values. Counts hits/misses/evictions so they can be inspected
+class LRUCache:
+    def __init__(self, name, maxBytes):
+        self.name = name
+        self.maxBytes = maxBytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Return the cached value (None on a miss) and mark it as most recently used
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # Return the cached value (None if it isn't cached) without counting a hit/miss or marking it as recently used (for internal lookups)
+    def peek(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            return entry[0] if entry is not None else None
+
+    # Cache a value, evicting the least recently used entries until the cache fits in maxBytes (values bigger than the cache aren't stored)
+    # The value is measured by pickling it unless the caller passes its size (e.g. values that keep track of their own size)
+    def set(self, key, value, size=None):
+        if size is None:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+        with self._lock:
+            self._remove(key)
+            self._store(key, value, size)
+
+    # Re-measure a cached value that was changed in place (e.g. it grew), evicting other entries if it no longer fits. Does nothing if the value isn't cached for the key anymore
+    def resize(self, key, value, size=None):
+        if size is None:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not value:
+                return
+
+            self._remove(key)
+            self._store(key, value, size)
+
+    # Remove every entry matching the predicate (called with each key) and return how many were removed
+    def removeWhere(self, predicate):
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    # List the cached keys (least recently used first) with the size of each entry
+    def inspect(self):
+        with self._lock:
+            return [{"key": key, "bytes": entry[1]} for key, entry in self._entries.items()]
+
+    def stats(self):
+        with self._lock:
+            return {"name": self.name, "entries": len(self._entries), "bytes": self.bytes, "maxBytes": self.maxBytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def _store(self, key, value, size):
+        if size > self.maxBytes:
+            return
+
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.maxBytes:
+            oldestKey = next(iter(self._entries))
+            self._remove(oldestKey)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+
+# Every cache in this worker process (for stats)
+caches = []
+
+
+# Register a cache so it's included in the cache stats
+def registerCache(cache):
+    caches.append(cache)
+
+    return cache
+
+
+# Per user cache of computed dashboard payloads, keyed by user and valid for the (day, data version) they were computed for
+dashboardCache = registerCache(LRUCache("dashboard", int(os.getenv("DASHBOARD_CACHE_BYTES", 16 * 1024 * 1024))))
+
+
+# Per user cache of computed reports, keyed by (user, report, year) and valid for the users (report version, year version) they were computed from
+reportCache = registerCache(LRUCache("reports", int(os.getenv("REPORT_CACHE_BYTES", 32 * 1024 * 1024))))
+
+# Per user cache of the expense history pagers (total, filtered) counts, keyed by (user, filters) and valid for the users data version they were counted at
+historyCountsCache = registerCache(LRUCache("historycounts", int(os.getenv("HISTORY_COUNTS_CACHE_BYTES", 2 * 1024 * 1024))))
+
+# Max age (seconds) of a cached report for the current year (closed years stay cached until a write touches them)
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", 300))
+
+
+# Queue a report recompute for the report worker ('flask report-worker') after every write that changes a users reports
+REPORT_WORKER = os.getenv("REPORT_WORKER", "false").lower() == "true"
+
+# SQL upsert of a (user, year) report job: a job that's already queued (or being worked on) is requeued rather than duplicated, so a burst of writes coalesces into one recompute
+REPORT_JOB_UPSERT = "ON CONFLICT (user_id, year) DO UPDATE SET requestedtime = clock_timestamp(), claimedtime = NULL"
+
+
+# Get a registered cache by name (None if there's no such cache)
+def getCache(name):
+    for cache in caches:
+        if cache.name == name:
+            return cache
+
+    return None
+
+
+# Get the users current data version (changes whenever any of their dashboard/report data changes)
+def getDataVersion(userID):
+    version = db.execute(
+        "SELECT dataversion FROM users WHERE id = :usersID", {"usersID": userID}).fetchone()[0]
+
+    return version
+
+
+# Bump the users data version to invalidate cached data computed from their old data. Doesn't commit: call it in the same transaction as the write
+def bumpDataVersion(userID):
+    db.execute("UPDATE users SET dataversion = dataversion + 1 WHERE id = :usersID",
+               {"usersID": userID})
+
+
+# Get the users (report version, year version) for a year. Both change whenever a write changes the users reports for that year
+def getReportVersion(userID, year):
+    version = db.execute(
+        "SELECT users.reportversion, COALESCE(useryearversions.version, 0) FROM users LEFT JOIN useryearversions ON useryearversions.user_id = users.id AND useryearversions.year = :year WHERE users.id = :usersID",
+        {"usersID": userID, "year": year}).fetchone()
+
+    return tuple(version)
+
+
+# Bump the users report version to invalidate every cached report of theirs (expense writes bump the versions of the years they touch instead, see tendie_rollup). Doesn't commit: call it in the same transaction as the write
+def bumpReportVersion(userID):
+    db.execute("UPDATE users SET reportversion = reportversion + 1 WHERE id = :usersID",
+               {"usersID": userID})
+
+    # Recompute every year the user has data in (and the current year)
+    if REPORT_WORKER:
+        db.execute(f"INSERT INTO reportjobs (user_id, year) SELECT :usersID, year FROM useryearversions WHERE user_id = :usersID UNION SELECT :usersID, :currentYear {REPORT_JOB_UPSERT}",
+                   {"usersID": userID, "currentYear": datetime.now().year})
+
+
+# Get and return the stats of every cache in this worker process
+def getCacheStats():
+    return [cache.stats() for cache in caches]
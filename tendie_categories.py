@@ -1,14 +1,11 @@
-import os
+import tendie_cache
+import tendie_rollup
+import tendie_suggest
 
 from flask import request, session
 from flask_session import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
 from helpers import convertSQLToDict
-
-# Create engine object to manage connections to DB, and scoped session to separate user interactions with DB
-engine = create_engine(os.getenv("DATABASE_URL"))
-db = scoped_session(sessionmaker(bind=engine))
+from tendie_db import db
 
 
 # Gets and return the users spend categories
@@ -25,7 +22,7 @@ def getSpendCategories(userID):
 # Gets and return the users *inactive* spend categories from their expenses (e.g. they deleted a category and didn't update their expense records that still use the old category name)
 def getSpendCategories_Inactive(userID):
     results = db.execute(
-        "SELECT category FROM expenses WHERE user_id = :usersID AND category NOT IN(SELECT categories.name FROM usercategories INNER JOIN categories ON categories.id = usercategories.category_id WHERE user_id = :usersID) GROUP BY category",
+        "SELECT category FROM spendingrollup WHERE user_id = :usersID AND category NOT IN(SELECT categories.name FROM usercategories INNER JOIN categories ON categories.id = usercategories.category_id WHERE user_id = :usersID) GROUP BY category",
         {"usersID": userID}).fetchall()
 
     categories = convertSQLToDict(results)
@@ -171,6 +168,8 @@ def addCategory_DB(newName):
 def addCategory_User(categoryID, userID):
     db.execute("INSERT INTO usercategories (user_id, category_id) VALUES (:usersID, :categoryID)",
                {"usersID": userID, "categoryID": categoryID})
+    tendie_cache.bumpDataVersion(userID)
+    tendie_cache.bumpReportVersion(userID)
     db.commit()
 
 
@@ -178,15 +177,27 @@ def addCategory_User(categoryID, userID):
 def deleteCategory_User(categoryID, userID):
     db.execute("DELETE FROM usercategories WHERE user_id = :usersID AND category_id = :categoryID",
                {"usersID": userID, "categoryID": categoryID})
+    tendie_cache.bumpDataVersion(userID)
+    tendie_cache.bumpReportVersion(userID)
     db.commit()
 
+    # Stop suggesting the deleted category
+    tendie_suggest.forgetModel(userID)
+
 
 # Update just the spend categories of expense records (used for category renaming)
 def updateExpenseCategoryNames(oldCategoryName, newCategoryName, userID):
     db.execute("UPDATE expenses SET category = :newName WHERE user_id = :usersID AND category = :oldName",
                {"newName": newCategoryName, "usersID": userID, "oldName": oldCategoryName})
+
+    # Rename the category in the users spending rollup and invalidate their cached data (same transaction)
+    tendie_rollup.renameKey("category", oldCategoryName, newCategoryName, userID)
+    tendie_cache.bumpDataVersion(userID)
     db.commit()
 
+    # Suggest the category by its new name
+    tendie_suggest.forgetModel(userID)
+
 
 # Rename a category
 def renameCategory(oldCategoryID, newCategoryID, oldCategoryName, newCategoryName, userID):
@@ -1,144 +1,62 @@
-import os
 import calendar
-import tendie_budgets
+import tendie_cache
+import tendie_rollup
 
 from flask import request, session
 from flask_session import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
-from helpers import convertSQLToDict
-from datetime import datetime
+from helpers import convertSQLToDict, weekRange, yearRange
+from tendie_db import db
+from datetime import datetime, date, timedelta
 
-# Create engine object to manage connections to DB, and scoped session to separate user interactions with DB
-engine = create_engine(os.getenv("DATABASE_URL"))
-db = scoped_session(sessionmaker(bind=engine))
 
+# Fill in the spent/remaining amounts for budgets queried with their total spent (shared by the budgets report and getDashboard)
+def buildBudgets(budgets):
+    for budget in budgets:
+        if (budget["spent"] == None):
+            budget["spent"] = 0
 
-# Get and return the users total spend for the current calendar year
-def getTotalSpend_Year(userID):
-    results = db.execute(
-        "SELECT SUM(amount) AS expenses_year FROM expenses WHERE user_id = :usersID AND date_part('year', date(expensedate)) = date_part('year', CURRENT_DATE)",
-        {"usersID": userID}).fetchall()
-
-    totalSpendYear = convertSQLToDict(results)
-
-    return totalSpendYear[0]['expenses_year']
-
-
-# Get and return the users total spend for the current month
-def getTotalSpend_Month(userID):
-    results = db.execute(
-        "SELECT SUM(amount) AS expenses_month FROM expenses WHERE user_id = :usersID AND date_part('year', date(expensedate)) = date_part('year', CURRENT_DATE) AND date_part('month', date(expensedate)) = date_part('month', CURRENT_DATE)",
-        {"usersID": userID}).fetchall()
-
-    totalSpendMonth = convertSQLToDict(results)
-
-    return totalSpendMonth[0]['expenses_month']
-
-
-# Get and return the users total spend for the current week
-def getTotalSpend_Week(userID):
-    # Query note: Day 0 of a week == Sunday. This query grabs expenses between the *current* weeks Monday and Sunday.
-    results = db.execute(
-        "SELECT SUM(amount) AS expenses_week FROM expenses WHERE user_id = :usersID AND date_part('year', date(expensedate)) = date_part('year', CURRENT_DATE) AND date_part('week', date(expensedate)) = date_part('week', CURRENT_DATE)",
-        {"usersID": userID}).fetchall()
-
-    totalSpendWeek = convertSQLToDict(results)
-
-    return totalSpendWeek[0]['expenses_week']
-
-
-# Get and return the users last 5 expenses
-def getLastFiveExpenses(userID):
-    results = db.execute(
-        "SELECT description, category, expenseDate, payer, amount FROM expenses WHERE user_id = :usersID ORDER BY id DESC LIMIT 5", {"usersID": userID}).fetchall()
-
-    lastFiveExpenses = convertSQLToDict(results)
+        # Set the remaining amount to 0 if the user has spent more than they budgeted for so that the charts don't look crazy
+        if (budget["spent"] > budget["amount"]):
+            budget["remaining"] = 0
+        else:
+            budget["remaining"] = budget["amount"] - budget["spent"]
 
-    if lastFiveExpenses:
-        return lastFiveExpenses
-    else:
-        return None
+    return budgets
 
 
-# Get and return all budgets for the user
-def getBudgets(userID, year=None):
-    budgets = []
-    budget = {"name": None, "amount": 0, "spent": 0, "remaining": 0}
+# Gets the start dates (Mondays) of the last N weeks in ascending order, e.g. weeks=4 looks back 3 weeks from the current week and *thru* the current week
+def getLastWeekStarts(weeks=4):
+    weekStart, weekEnd = weekRange(date.today())
 
-    # Default to getting current years budgets
-    if not year:
-        year = datetime.now().year
-
-    budgets_query = tendie_budgets.getBudgets(userID)
-    # Build a budget dict to return
-    if budgets_query and year in budgets_query:
-        for record in budgets_query[year]:
-            budgetID = record["id"]
-            budget["name"] = record["name"]
-            budget["amount"] = record["amount"]
-
-            # Query the DB for the budgets total spent amount (calculated as the sum of expenses with categories that match the categories selected for the individual budget)
-            results = db.execute(
-                "SELECT SUM(amount) AS spent FROM expenses WHERE user_id = :usersID AND date_part('year', date(expensedate)) = :year AND category IN (SELECT categories.name FROM budgetcategories INNER JOIN categories on budgetcategories.category_id = categories.id WHERE budgetcategories.budgets_id = :budgetID)",
-                {"usersID": userID, "year": year, "budgetID": budgetID}).fetchall()
-            budget_TotalSpent = convertSQLToDict(results)
-
-            if (budget_TotalSpent[0]["spent"] == None):
-                budget["spent"] = 0
-            else:
-                budget["spent"] = budget_TotalSpent[0]["spent"]
-
-            # Set the remaining amount to 0 if the user has spent more than they budgeted for so that the charts don't look crazy
-            if (budget["spent"] > budget["amount"]):
-                budget["remaining"] = 0
-            else:
-                budget["remaining"] = budget["amount"] - budget["spent"]
-
-            # Add the budget to the list
-            budgets.append(budget.copy())
-
-        return budgets
-
-    # Return None if no budget was found
-    else:
-        return None
+    return [weekStart - timedelta(weeks=i) for i in range(weeks - 1, -1, -1)]
 
 
-# Gets the last four weeks start dates and end dates (e.g. '2020-04-13' and '2020-04-19')
-def getLastFourWeekNames():
-    # Query note: looks back 3 weeks from the current week and *thru* the current week to give a total of 4 weeks of start/end dates
-    results = db.execute("SELECT date_trunc('week', CURRENT_DATE)::date AS startofweek, (date_trunc('week', CURRENT_DATE) + interval '6 day')::date AS endofweek UNION SELECT date_trunc('week', CURRENT_DATE - interval '1 week')::date AS startofweek, (date_trunc('week', CURRENT_DATE - interval '1 week') + interval '6 day')::date AS endofweek UNION SELECT date_trunc('week', CURRENT_DATE - interval '2 week')::date AS startofweek, (date_trunc('week', CURRENT_DATE - interval '2 week') + interval '6 day')::date AS endofweek UNION SELECT date_trunc('week', CURRENT_DATE - interval '3 week')::date AS startofweek, (date_trunc('week', CURRENT_DATE - interval '3 week') + interval '6 day')::date AS endofweek ORDER BY startofweek ASC").fetchall()
+# Get and return weekly spending for the user over the last N weeks (line chart)
+def getWeeklySpending(userID, weeks=4):
+    weekStarts = getLastWeekStarts(weeks)
 
-    weekNames = convertSQLToDict(results)
+    # Query note: one range scan over the spending rollup for all of the weeks, summed by the Monday each week starts on
+    weekAmounts = tendie_rollup.getWeeklyTotals(
+        weekStarts[0], weekStarts[-1] + timedelta(weeks=1), userID)
 
-    return weekNames
+    return buildWeeklySpending(weekStarts, weekAmounts)
 
 
-# Get and return weekly spending for the user (line chart)
-def getWeeklySpending(weekNames, userID):
+# Build the weekly spending list (names/amounts per week) from the week totals keyed by start of week (shared by getWeeklySpending and getDashboard)
+def buildWeeklySpending(weekStarts, weekAmounts):
     weeklySpending = []
     week = {"startOfWeek": None, "endOfWeek": None, "amount": None}
 
-    # Loop through each week and store the name/amount in a dict
-    for name in weekNames:
-        week["endOfWeek"] = name['endofweek'].strftime('%b %d')
-        week["startOfWeek"] = name['startofweek'].strftime('%b %d')
-        results = db.execute(
-            "SELECT SUM(amount) AS amount FROM expenses WHERE user_id = :usersID AND date_part('year', date(expensedate)) = date_part('year', date(:weekName)) AND date_part('week', date(expensedate)) = date_part('week',date(:weekName))",
-            {"usersID": userID, "weekName": str(name["endofweek"])}).fetchall()
-        weekSpending = convertSQLToDict(results)
-
-        # Set the amount to 0 if there are no expenses for a given week
-        if weekSpending[0]["amount"] == None:
-            week["amount"] = 0
-        else:
-            week["amount"] = weekSpending[0]["amount"]
+    # Loop through each week and store the name/amount in a dict, setting the amount to 0 if there are no expenses for a given week
+    for startOfWeek in weekStarts:
+        week["startOfWeek"] = startOfWeek.strftime('%b %d')
+        week["endOfWeek"] = (startOfWeek + timedelta(days=6)).strftime('%b %d')
+        week["amount"] = weekAmounts.get(startOfWeek, 0)
 
         # Add the week to the list
         weeklySpending.append(week.copy())
 
-    # Check to make sure at least 1 of the 4 weeks has expenses, otherwise set it to None so that the UI can be rendered with an appropriate message
+    # Check to make sure at least 1 of the weeks has expenses, otherwise set it to None so that the UI can be rendered with an appropriate message
     hasExpenses = False
     for record in weeklySpending:
         if record["amount"] != 0:
@@ -152,17 +70,21 @@ def getWeeklySpending(weekNames, userID):
 
 # Get and return monthly spending for a given year (bar chart)
 def getMonthlySpending(userID, year=None):
-    spending_month = []
-    month = {"name": None, "amount": None}
-
     # Default to getting current years spending
     if not year:
         year = datetime.now().year
 
-    results = db.execute(
-        "SELECT date_part('month', date(expensedate)) AS month, SUM(amount) AS amount FROM expenses WHERE user_id = :usersID AND date_part('year', date(expensedate)) = :year GROUP BY date_part('month', date(expensedate)) ORDER BY month",
-        {"usersID": userID, "year": year}).fetchall()
-    spending_month_query = convertSQLToDict(results)
+    start, end = yearRange(year)
+    totals = tendie_rollup.getRangeTotals(userID, start, end, "month")
+    spending_month_query = [{"month": month.month, "amount": totals[month]["amount"]} for month in sorted(totals)]
+
+    return buildMonthlySpending(spending_month_query)
+
+
+# Convert monthly spending query results into named months for the bar chart (shared by getMonthlySpending and getDashboard)
+def buildMonthlySpending(spending_month_query):
+    spending_month = []
+    month = {"name": None, "amount": None}
 
     for record in spending_month_query:
         month["name"] = calendar.month_abbr[int(record["month"])]
@@ -176,17 +98,23 @@ def getMonthlySpending(userID, year=None):
 # Get and return trends for every spending category that accounts for >1% of overall spend (bubble chart)
 def getSpendingTrends(userID, year=None):
 
-    spending_trends = []
-    categoryTrend = {"name": None, "proportionalAmount": None,
-                     "totalSpent": None, "totalCount": None}
-
     # Default to getting current years spending
     if not year:
         year = datetime.now().year
 
-    results = db.execute("SELECT category, COUNT(category) as count, SUM(amount) as amount FROM expenses WHERE user_id = :usersID AND date_part('year', date(expensedate)) = :year GROUP BY category ORDER BY COUNT(category) DESC",
-                         {"usersID": userID, "year": year}).fetchall()
-    categories = convertSQLToDict(results)
+    start, end = yearRange(year)
+    totals = tendie_rollup.getRangeTotals(userID, start, end, "category")
+    categories = [{"category": category, "count": total["count"], "amount": total["amount"]} for category, total in totals.items()]
+    categories.sort(key=lambda category: category["count"], reverse=True)
+
+    return buildSpendingTrends(categories)
+
+
+# Calculate each categories share of overall spend for the bubble chart (shared by getSpendingTrends and getDashboard)
+def buildSpendingTrends(categories):
+    spending_trends = []
+    categoryTrend = {"name": None, "proportionalAmount": None,
+                     "totalSpent": None, "totalCount": None}
 
     # Calculate the total amount spent
     totalSpent = 0
@@ -206,3 +134,96 @@ def getSpendingTrends(userID, year=None):
             spending_trends.append(categoryTrend.copy())
 
     return spending_trends
+
+
+# Each payers spending and share of the total (%) for a year, in one pass over the users rollup: the payers spending FULL JOINed with their payers (payers without spending get 0, payers that were deleted but still have expenses are kept) and the % from a window SUM
+# Shared by the payers report and getDashboard (as a sub-select), params :usersID and :year. Served by the (user_id, year, payer) INCLUDE (amount) rollup index
+PAYERS_SPENDING_SQL = 'SELECT name, COALESCE(spent.amount, 0) AS amount, round(COALESCE(spent.amount, 0) * 100 / NULLIF(SUM(spent.amount) OVER (), 0))::integer AS "percentAmount" FROM (SELECT payer AS name, SUM(amount) AS amount FROM spendingrollup WHERE user_id = :usersID AND year = :year GROUP BY payer) AS spent FULL JOIN (SELECT name FROM payers WHERE user_id = :usersID) AS userpayers USING (name) ORDER BY amount DESC, name'
+
+
+# Get and return each payers spending and % paid for the year
+def getPayersSpending(userID, year=None):
+    # Default to getting current years spending
+    if not year:
+        year = datetime.now().year
+
+    results = db.execute(PAYERS_SPENDING_SQL, {"usersID": userID, "year": year}).fetchall()
+
+    return buildPayersSpending(convertSQLToDict(results))
+
+
+# Payers spending (from PAYERS_SPENDING_SQL) for the payers chart/table. Returns None if nothing was paid so the UI can render an appropriate message
+def buildPayersSpending(payers):
+    if not any(payer["amount"] for payer in payers):
+        return None
+
+    return payers
+
+
+# Get and return everything the dashboard renders in a single round trip to the DB
+# Query note: each dashboard figure is a JSON sub-select over the users spending rollup for the current year, so the query costs O(categories * payers) rather than O(expenses)
+def getDashboard(userID, weeks=4):
+    today = date.today()
+
+    # Weekly spending chart covers the current week and the N-1 weeks before it (the current week is the last of them)
+    weekStarts = getLastWeekStarts(weeks)
+    weeksEnd = weekStarts[-1] + timedelta(weeks=1)
+    weeklyTotalsSQL, weeklyTotalsParams = tendie_rollup.getWeeklyTotalsSQL(weekStarts[0], weeksEnd)
+
+    params = {"usersID": userID, "year": today.year, "month": today.month}
+    params.update(weeklyTotalsParams)
+
+    results = db.execute(f"""
+        WITH yearrollup AS (
+            SELECT month, category, payer, count, amount FROM spendingrollup WHERE user_id = :usersID AND year = :year
+        )
+        SELECT
+            (SELECT income FROM users WHERE id = :usersID) AS income,
+            (SELECT json_agg(c) FROM (SELECT categories.name FROM usercategories INNER JOIN categories ON usercategories.category_id = categories.id WHERE usercategories.user_id = :usersID) c) AS categories,
+            (SELECT json_agg(p) FROM (SELECT name FROM payers WHERE user_id = :usersID ORDER BY name ASC) p) AS payers,
+            (SELECT SUM(amount) FROM yearrollup) AS expenses_year,
+            (SELECT SUM(amount) FROM yearrollup WHERE month = :month) AS expenses_month,
+            (SELECT json_agg(l) FROM (SELECT description, category, expensedate, payer, amount FROM expenses WHERE user_id = :usersID ORDER BY id DESC LIMIT 5) l) AS expenses_last5,
+            (SELECT json_agg(b ORDER BY b.name) FROM (
+                SELECT budgets.name, budgets.amount, SUM(yearrollup.amount) AS spent FROM budgets
+                LEFT JOIN (SELECT DISTINCT budgetcategories.budgets_id, categories.name FROM budgetcategories INNER JOIN categories ON budgetcategories.category_id = categories.id INNER JOIN budgets ON budgetcategories.budgets_id = budgets.id WHERE budgets.user_id = :usersID AND budgets.year = :year) AS budgetcategorynames ON budgetcategorynames.budgets_id = budgets.id
+                LEFT JOIN yearrollup ON yearrollup.category = budgetcategorynames.name
+                WHERE budgets.user_id = :usersID AND budgets.year = :year GROUP BY budgets.id, budgets.name, budgets.amount) b) AS budgets,
+            (SELECT json_agg(w) FROM ({weeklyTotalsSQL}) w) AS spending_week,
+            (SELECT json_agg(m ORDER BY m.month) FROM (SELECT month, SUM(amount) AS amount FROM yearrollup GROUP BY month) m) AS spending_month,
+            (SELECT json_agg(t ORDER BY t.count DESC) FROM (SELECT category, SUM(count) AS count, SUM(amount) AS amount FROM yearrollup GROUP BY category) t) AS spending_trends,
+            (SELECT json_agg(py ORDER BY py.amount DESC, py.name) FROM ({PAYERS_SPENDING_SQL}) py) AS payers_spending
+        """, params).fetchone()
+
+    # Sum the weekly rollup rows per week (the current week's total is the dashboards weekly expenses figure)
+    weekAmounts = tendie_rollup.sumWeeklyTotals(results["spending_week"] or [], weekStarts[0], weeksEnd)
+
+    # Build the same data structures the individual dashboard functions return (json_agg returns NULL instead of an empty list when there are no rows)
+    dashboard = {"categories": results["categories"] or [], "payers": results["payers"] or [], "date": today.strftime('%Y-%m-%d'),
+                 "income": float(results["income"]), "expenses_year": results["expenses_year"], "expenses_month": results["expenses_month"],
+                 "expenses_week": weekAmounts.get(weekStarts[-1]), "expenses_last5": results["expenses_last5"], "budgets": None}
+
+    if results["budgets"]:
+        dashboard["budgets"] = buildBudgets(results["budgets"])
+
+    dashboard["spending_week"] = buildWeeklySpending(weekStarts, weekAmounts)
+    dashboard["spending_month"] = buildMonthlySpending(results["spending_month"] or [])
+    dashboard["spending_trends"] = buildSpendingTrends(results["spending_trends"] or [])
+    dashboard["payersChart"] = buildPayersSpending(results["payers_spending"] or [])
+
+    return dashboard
+
+
+# Get and return the users dashboard from the dashboard cache, only computing it when their data (or the day) changed since it was cached
+def getCachedDashboard(userID):
+    validFor = (date.today(), tendie_cache.getDataVersion(userID))
+
+    # Entries are ((day, data version), dashboard): one entry per user, replaced when it's recomputed
+    entry = tendie_cache.dashboardCache.get(userID)
+    if entry is not None and entry[0] == validFor:
+        return entry[1]
+
+    dashboard = getDashboard(userID)
+    tendie_cache.dashboardCache.set(userID, (validFor, dashboard))
+
+    return dashboard
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+
+# Pool settings (override with env vars to size gunicorn workers against the Postgres connection limit: workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) <= max connections)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 2))
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+
+# QueuePool that records how long callers wait to check out a connection
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._statsLock = threading.Lock()
+        self._checkouts = 0
+        self._waitTotal = 0.0
+        self._waitMax = 0.0
+        self._timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self._statsLock:
+                self._timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._statsLock:
+                self._checkouts += 1
+                self._waitTotal += waited
+                self._waitMax = max(self._waitMax, waited)
+
+    def waitStats(self):
+        with self._statsLock:
+            return {"checkouts": self._checkouts, "timeouts": self._timeouts, "waitTotal": self._waitTotal, "waitMax": self._waitMax}
+
+
+# The one engine object for the app (every tendie_* module imports 'db' from here so each worker process only opens a single pool)
+engine = create_engine(os.getenv("DATABASE_URL"), poolclass=InstrumentedQueuePool, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                       pool_timeout=POOL_TIMEOUT, pool_recycle=POOL_RECYCLE, pool_pre_ping=POOL_PRE_PING)
+
+# Scoped session to separate user interactions with DB (one session per thread, released at the end of every request)
+db = scoped_session(sessionmaker(bind=engine))
+
+
+# Get and return live stats for the connection pool of this worker process
+def getPoolStats():
+    pool = engine.pool
+    waits = pool.waitStats()
+
+    stats = {"pid": os.getpid(), "size": pool.size(), "maxOverflow": MAX_OVERFLOW, "checkedIn": pool.checkedin(),
+             "checkedOut": pool.checkedout(), "overflow": max(pool.overflow(), 0), "timeouts": waits["timeouts"],
+             "checkouts": waits["checkouts"], "waitMaxMs": round(waits["waitMax"] * 1000, 3), "waitAvgMs": 0}
+
+    if waits["checkouts"]:
+        stats["waitAvgMs"] = round(waits["waitTotal"] / waits["checkouts"] * 1000, 3)
+
+    return stats
+
+
+# Directory holding the versioned schema migrations (applied in file name order, e.g. '0001_expense_date_types.sql')
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+# Apply any migrations that haven't been recorded in the schemamigrations table yet and return the versions that were applied
+def runMigrations():
+    applied = []
+
+    with engine.begin() as connection:
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS schemamigrations (version TEXT PRIMARY KEY, appliedtime TIMESTAMP NOT NULL DEFAULT now())")
+
+    for fileName in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not fileName.endswith(".sql"):
+            continue
+        version = fileName[:-4]
+
+        # Each migration runs in its own transaction together with the record of it being applied
+        with engine.begin() as connection:
+            exists = connection.execute(
+                text("SELECT 1 FROM schemamigrations WHERE version = :version"), {"version": version}).fetchone()
+            if exists:
+                continue
+
+            # Run the file through the raw DBAPI cursor so SQL like 'HH24:MI:SS' isn't mistaken for bind parameters
+            with open(os.path.join(MIGRATIONS_DIR, fileName)) as migration:
+                connection.connection.cursor().execute(migration.read())
+            connection.execute(
+                text("INSERT INTO schemamigrations (version) VALUES (:version)"), {"version": version})
+            applied.append(version)
+
+    return applied
+
+
+# Try to take (or renew) the named lease for 'seconds' and return True if this owner holds it. Used so only one process runs a scheduled job at a time
+# The lease is committed on its own connection so it's visible to other processes while the job's transaction is still running
+def acquireLease(name, owner, seconds):
+    with engine.begin() as connection:
+        result = connection.execute(
+            text("INSERT INTO schedulerleases (name, owner, expires) VALUES (:name, :owner, now() + make_interval(secs => :seconds)) ON CONFLICT (name) DO UPDATE SET owner = EXCLUDED.owner, expires = EXCLUDED.expires WHERE schedulerleases.expires < now() OR schedulerleases.owner = EXCLUDED.owner RETURNING owner"),
+            {"name": name, "owner": owner, "seconds": seconds}).fetchone()
+
+    return result is not None
+
+
+# Give up the named lease (if this owner still holds it)
+def releaseLease(name, owner):
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE schedulerleases SET expires = now() WHERE name = :name AND owner = :owner"),
+                           {"name": name, "owner": owner})
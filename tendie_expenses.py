@@ -1,16 +1,22 @@
-import os
+import json
+import tendie_cache
 import calendar
+import math
+import tendie_rollup
+import tendie_account
+import tendie_suggest
+import tendie_categories
 
 from flask import request, session
 from flask_session import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
-from datetime import datetime
+from datetime import date, datetime
+from psycopg2.extras import execute_values
+from sqlalchemy.exc import IntegrityError
 from helpers import convertSQLToDict
+from tendie_db import db
 
-# Create engine object to manage connections to DB, and scoped session to separate user interactions with DB
-engine = create_engine(os.getenv("DATABASE_URL"))
-db = scoped_session(sessionmaker(bind=engine))
+# Max number of expenses sent in one multi-row INSERT statement
+INSERT_PAGE_SIZE = 1000
 
 
 # Add expense(s) to the users expense records
@@ -26,8 +32,8 @@ def addExpenses(formData, userID):
             # Add to dictionary
             expense[key] = value.strip()
 
-        # Convert the amount from string to float for the DB
-        expense["amount"] = float(expense["amount"])
+        # Validate the expense and convert the amount from string to float for the DB
+        validateExpense(expense)
 
         # Add dictionary to list (to comply with design/standard of expensed.html)
         expenses.append(expense)
@@ -45,81 +51,318 @@ def addExpenses(formData, userID):
             # Every 5 loops add the expense to the list of expenses (because there are 5 fields for an expense record)
             counter += 1
             if counter % 5 == 0:
-                # Store the amount as a float
-                expense["amount"] = float(expense["amount"])
+                # Validate the expense and store the amount as a float
+                validateExpense(expense)
 
                 # Add dictionary to list
                 expenses.append(expense.copy())
 
-    # Insert expenses into DB
-    for expense in expenses:
-        now = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
-        db.execute("INSERT INTO expenses (description, category, expenseDate, amount, payer, submitTime, user_id) VALUES (:description, :category, :expenseDate, :amount, :payer, :submitTime, :usersID)",
-                   {"description": expense["description"], "category": expense["category"], "expenseDate": expense["date"], "amount": expense["amount"], "payer": expense["payer"], "submitTime": now, "usersID": userID})
-    db.commit()
+    # Flag expenses that are already in the users history (e.g. the form was submitted twice) so the results page can point them out
+    duplicates = findDuplicates(expenses, userID)
+    for index, expense in enumerate(expenses):
+        expense["duplicate"] = index in duplicates
+
+    # Insert expenses into DB and teach the users suggestion model about them
+    insertExpenses(expenses, userID)
+    tendie_suggest.learnExpenses(expenses, userID)
 
     return expenses
 
 
-# Get and return the users lifetime expense history
-def getHistory(userID):
-    results = db.execute("SELECT description, category, expenseDate AS date, payer, amount, submitTime FROM expenses WHERE user_id = :usersID ORDER BY id ASC",
-                         {"usersID": userID}).fetchall()
+# Validate an expense dict (description/category/date/amount/payer) before it's stored, converting the amount to a float for the DB. Raises ValueError for invalid expenses
+# Shared by every path that creates expenses (forms, imports, recurring expenses)
+def validateExpense(expense):
+    for key in ["description", "category", "date", "payer"]:
+        if not expense[key] or not str(expense[key]).strip():
+            raise ValueError(f"Expense is missing a {key}")
+        expense[key] = str(expense[key]).strip()
+
+    # Description max length matches the HTML forms
+    if len(expense["description"]) > 200:
+        raise ValueError("Expense description must be 200 characters or less")
+
+    try:
+        date.fromisoformat(expense["date"])
+    except ValueError:
+        raise ValueError(f"Expense date '{expense['date']}' must be a YYYY-MM-DD date")
+
+    try:
+        expense["amount"] = float(str(expense["amount"]).replace("$", "").replace(",", "").strip())
+    except ValueError:
+        raise ValueError(f"Expense amount '{expense['amount']}' must be a number")
+    if not math.isfinite(expense["amount"]) or expense["amount"] < 0:
+        raise ValueError("Expense amount must be a positive number")
+
+    return expense
+
+
+# Insert expenses into the DB for the user as a single all-or-nothing transaction and return their new IDs
+def insertExpenses(expenses, userID, submitTime=None):
+    try:
+        expenseIDs = writeExpenses(expenses, userID, submitTime)
+
+        # Invalidate the users cached data in the same transaction
+        tendie_cache.bumpDataVersion(userID)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return expenseIDs
+
+
+# Check expenses against the users existing expenses and return the indexes (in the list) of expenses that already exist (same date, amount in cents and normalised description)
+# Query note: fingerprints are computed by the same SQL function as the expenses.fingerprint column, so each expense is one (user_id, fingerprint) index probe
+def findDuplicates(expenses, userID):
+    if not expenses:
+        return set()
+
+    results = db.execute("SELECT candidate.n - 1 FROM unnest(CAST(:dates AS DATE[]), CAST(:amounts AS REAL[]), CAST(:descriptions AS TEXT[])) WITH ORDINALITY AS candidate (expensedate, amount, description, n) WHERE EXISTS (SELECT 1 FROM expenses WHERE user_id = :usersID AND fingerprint = expense_fingerprint(candidate.expensedate, candidate.amount, candidate.description))",
+                         {"usersID": userID, "dates": [str(expense["date"]) for expense in expenses], "amounts": [expense["amount"] for expense in expenses],
+                          "descriptions": [expense["description"] for expense in expenses]}).fetchall()
+
+    return {result[0] for result in results}
+
+
+# Write expenses for the user and add them to the users spending rollup in the sessions current transaction (the caller commits) and return the IDs of the expenses written
+# Expenses from a recurring expense carry its 'recurringID' and are skipped if that occurrence (recurring expense + date) already exists, so materialising an occurrence twice is harmless
+# Query note: rows are sent as multi-row INSERTs (INSERT_PAGE_SIZE rows per statement) instead of one INSERT per expense, and every row shares one submit time
+def writeExpenses(expenses, userID, submitTime=None):
+    if not submitTime:
+        submitTime = datetime.now().replace(microsecond=0)
+
+    rows = [(expense["description"], expense["category"], expense["date"], expense["amount"], expense["payer"], submitTime, userID, expense.get("recurringID"))
+            for expense in expenses]
+
+    # Use the sessions own DBAPI connection so the insert is part of the sessions transaction
+    cursor = db.connection().connection.cursor()
+    results = execute_values(cursor, "INSERT INTO expenses (description, category, expenseDate, amount, payer, submitTime, user_id, recurring_id) VALUES %s ON CONFLICT (recurring_id, expenseDate) WHERE recurring_id IS NOT NULL DO NOTHING RETURNING id",
+                             rows, page_size=INSERT_PAGE_SIZE, fetch=True)
+    expenseIDs = [result[0] for result in results]
+
+    # Add the new expenses to the users spending rollup
+    tendie_rollup.addExpenses(expenseIDs, userID)
+
+    return expenseIDs
+
+
+# Parse expense filters (start/end date, categories, payers, description search, expense IDs) from request args. Raises ValueError for invalid dates/IDs
+def getExpenseFilters(args):
+    filters = {"startDate": None, "endDate": None, "categories": [], "payers": [], "search": None, "expenseIDs": []}
+
+    if args.get("startDate"):
+        filters["startDate"] = date.fromisoformat(args.get("startDate").strip())
+    if args.get("endDate"):
+        filters["endDate"] = date.fromisoformat(args.get("endDate").strip())
+
+    filters["categories"] = [category.strip() for category in args.getlist("category") if category.strip()]
+    filters["payers"] = [payer.strip() for payer in args.getlist("payer") if payer.strip()]
+    filters["search"] = args.get("search", "").strip()
+    filters["expenseIDs"] = [int(expenseID) for expenseID in args.getlist("expenseID") if expenseID.strip()]
+
+    return filters
+
+
+# Build the SQL WHERE clause (and its params) for the users expenses matching the filters (dates are inclusive)
+# Shared by every query that works on a filtered set of expenses so they all select exactly the same rows
+def getExpenseFilterSQL(filters, userID):
+    where = ["user_id = :usersID"]
+    params = {"usersID": userID}
+
+    if filters.get("startDate"):
+        where.append("expensedate >= :startDate")
+        params["startDate"] = filters["startDate"]
+    if filters.get("endDate"):
+        where.append("expensedate <= :endDate")
+        params["endDate"] = filters["endDate"]
+    if filters.get("categories"):
+        where.append("category = ANY(:categories)")
+        params["categories"] = list(filters["categories"])
+    if filters.get("payers"):
+        where.append("payer = ANY(:payers)")
+        params["payers"] = list(filters["payers"])
+    if filters.get("search"):
+        # Substring match (escaping LIKE wildcards), served by the (user_id, description) trigram index
+        where.append("description ILIKE :search")
+        params["search"] = "%" + filters["search"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    if filters.get("expenseIDs"):
+        where.append("id = ANY(:expenseIDs)")
+        params["expenseIDs"] = list(filters["expenseIDs"])
+
+    return " AND ".join(where), params
+
+
+# Expense history columns (DataTables column index -> DB column) that can be sorted. Each has a (user_id, column, id) index for keyset pagination
+HISTORY_SORT_COLUMNS = ["id", "description", "category", "expensedate", "payer", "amount"]
+
+# Max number of expenses returned for one page of the expense history
+HISTORY_MAX_PAGE_SIZE = 100
+
+
+# Check if the user has any expenses
+def hasExpenses(userID):
+    result = db.execute("SELECT EXISTS (SELECT 1 FROM expenses WHERE user_id = :usersID)",
+                        {"usersID": userID}).fetchone()
+
+    return result[0]
+
+
+# Get and return the total and filtered expense counts for the expense history pager (only counting twice when there are filters)
+# Counts are cached against the users data version, so paging through the same filters/search only counts the expenses once
+def getHistoryCounts(where, params, userID):
+    key = (userID, where, repr(sorted(params.items())))
+    dataVersion = tendie_cache.getDataVersion(userID)
+
+    entry = tendie_cache.historyCountsCache.get(key)
+    if entry is not None and entry[0] == dataVersion:
+        return entry[1]
+
+    recordsTotal = db.execute("SELECT COUNT(*) FROM expenses WHERE user_id = :usersID", {"usersID": userID}).fetchone()[0]
+    if where == "user_id = :usersID":
+        recordsFiltered = recordsTotal
+    else:
+        recordsFiltered = db.execute(f"SELECT COUNT(*) FROM expenses WHERE {where}", params).fetchone()[0]
+
+    # Stored under the version read before counting, so a write made while counting makes the next page count again
+    counts = (recordsTotal, recordsFiltered)
+    tendie_cache.historyCountsCache.set(key, (dataVersion, counts))
+
+    return counts
+
+
+# Get and return one page of the users expense history for a DataTables server-side processing request (https://datatables.net/manual/server-side)
+# Pages are found with keyset pagination when the client sends the cursor of the previous page (WHERE (sort column, id) > cursor, using a (user_id, sort column, id) index) so deep pages cost the same as the first one. OFFSET is only used when jumping to a page without a cursor
+def getHistoryPage(args, userID):
+    draw = int(args.get("draw", 0))
+    start = max(int(args.get("start", 0)), 0)
+    length = int(args.get("length", 10))
+    if length < 1 or length > HISTORY_MAX_PAGE_SIZE:
+        length = HISTORY_MAX_PAGE_SIZE
+
+    # Sort column/direction (defaults to newest expenses first)
+    sortIndex = int(args.get("order[0][column]", 0))
+    sortColumn = HISTORY_SORT_COLUMNS[sortIndex] if 0 <= sortIndex < len(HISTORY_SORT_COLUMNS) else "id"
+    sortDirection = "ASC" if args.get("order[0][dir]") == "asc" else "DESC"
+
+    # Filters (date range, category, payer) and the search box
+    filters = getExpenseFilters(args)
+    filters["search"] = args.get("search[value]", "").strip()
+    where, params = getExpenseFilterSQL(filters, userID)
+    recordsTotal, recordsFiltered = getHistoryCounts(where, params, userID)
+
+    # Seek past the previous page when the client has its cursor, otherwise fall back to OFFSET
+    pageWhere = where
+    offset = start
+    cursor = getHistoryCursor(args.get("cursor"), sortColumn)
+    if cursor:
+        comparison = ">" if sortDirection == "ASC" else "<"
+        if sortColumn == "id":
+            pageWhere += f" AND id {comparison} :cursorID"
+        else:
+            # Amounts are REAL, so compare the cursor as REAL too (a float8 cursor would round differently and repeat/skip rows)
+            cursorValue = "CAST(:cursorValue AS REAL)" if sortColumn == "amount" else ":cursorValue"
+            pageWhere += f" AND ({sortColumn}, id) {comparison} ({cursorValue}, :cursorID)"
+            params["cursorValue"] = cursor[0]
+        params["cursorID"] = cursor[1]
+        offset = 0
+
+    orderBy = "id " + sortDirection if sortColumn == "id" else f"{sortColumn} {sortDirection}, id {sortDirection}"
+    params.update({"limit": length, "offset": offset})
+    results = db.execute(f"SELECT id, description, category, expensedate AS date, payer, amount, submittime, version FROM expenses WHERE {pageWhere} ORDER BY {orderBy} LIMIT :limit OFFSET :offset",
+                         params).fetchall()
 
     history = convertSQLToDict(results)
+    for expense in history:
+        # Dates are sent as text in the same format the history page/modal always used (the modal posts them back to find the expense)
+        expense["date"] = str(expense["date"])
+        expense["submittime"] = str(expense["submittime"])
+
+    # Cursor for the page after this one
+    nextCursor = None
+    if len(history) == length:
+        last = history[-1]
+        sortKey = {"expensedate": "date"}.get(sortColumn, sortColumn)
+        nextCursor = json.dumps([last[sortKey], last["id"]])
+
+    return {"draw": draw, "recordsTotal": recordsTotal, "recordsFiltered": recordsFiltered, "data": history, "cursor": nextCursor}
+
+
+# Parse a history page cursor ('[sort value, id]' JSON) sent by the client. Returns None if it's missing or invalid
+def getHistoryCursor(cursor, sortColumn):
+    if not cursor:
+        return None
+
+    try:
+        value, expenseID = json.loads(cursor)
+        expenseID = int(expenseID)
+        if sortColumn == "expensedate":
+            value = date.fromisoformat(value)
+        elif sortColumn == "amount":
+            value = float(value)
+        elif sortColumn != "id":
+            value = str(value)
+    except (TypeError, ValueError):
+        return None
 
-    return history
+    return (value, expenseID)
 
 
-# Get and return an existing expense record with ID from the DB
+# Get and return an existing expense record by its ID (posted from the expense history modal along with the version the user was editing)
 def getExpense(formData, userID):
     expense = {"description": None, "category": None,
-               "date": None, "amount": None, "payer": None, "submitTime": None, "id": None}
-    expense["description"] = formData.get("oldDescription").strip()
-    expense["category"] = formData.get("oldCategory").strip()
-    expense["date"] = formData.get("oldDate").strip()
-    expense["amount"] = formData.get("oldAmount").strip()
-    expense["payer"] = formData.get("oldPayer").strip()
-    expense["submitTime"] = formData.get("submitTime").strip()
-
-    # Remove dollar sign and comma from the old expense so we can convert to float for the DB
-    expense["amount"] = float(
-        expense["amount"].replace("$", "").replace(",", ""))
-
-    # Query the DB for the expense unique identifier
-    expenseID = db.execute("SELECT id FROM expenses WHERE user_id = :usersID AND description = :oldDescription AND category = :oldCategory AND expenseDate = :oldDate AND amount = :oldAmount AND payer = :oldPayer AND submitTime = :oldSubmitTime",
-                           {"usersID": userID, "oldDescription": expense["description"], "oldCategory": expense["category"], "oldDate": expense["date"], "oldAmount": expense["amount"], "oldPayer": expense["payer"], "oldSubmitTime": expense["submitTime"]}).fetchone()
-
-    # Make sure a record was found for the expense otherwise set as None
-    if expenseID:
-        expense["id"] = expenseID[0]
-    else:
-        expense["id"] = None
+               "date": None, "amount": None, "payer": None, "submitTime": None, "id": None, "version": None, "formVersion": None}
+
+    try:
+        expenseID = int(formData.get("expenseID", ""))
+        expense["formVersion"] = int(formData.get("version", ""))
+    except ValueError:
+        return expense
+
+    # Query the DB for the expense by its primary key (scoped to the user)
+    result = db.execute("SELECT id, description, category, expenseDate AS date, amount, payer, submitTime, version FROM expenses WHERE id = :expenseID AND user_id = :usersID",
+                        {"expenseID": expenseID, "usersID": userID}).fetchone()
+
+    # Make sure a record was found otherwise leave the ID as None
+    if result:
+        expense["description"] = result["description"]
+        expense["category"] = result["category"]
+        expense["date"] = str(result["date"])
+        expense["amount"] = result["amount"]
+        expense["payer"] = result["payer"]
+        expense["submitTime"] = result["submittime"]
+        expense["id"] = result["id"]
+        expense["version"] = result["version"]
 
     return expense
 
 
 # Delete an existing expense record for the user
 def deleteExpense(expense, userID):
-    result = db.execute("DELETE FROM expenses WHERE user_id = :usersID AND id = :oldExpenseID",
-                        {"usersID": userID, "oldExpenseID": expense["id"]})
+    # Remove the expense from the users spending rollup before it's deleted (same transaction)
+    tendie_rollup.removeExpenses([expense["id"]], userID)
+
+    # Only delete the version of the expense the user saw (optimistic concurrency: another tab may have changed it since)
+    result = db.execute("DELETE FROM expenses WHERE user_id = :usersID AND id = :oldExpenseID AND version = :version",
+                        {"usersID": userID, "oldExpenseID": expense["id"], "version": expense["formVersion"]}).rowcount
+    if not result:
+        db.rollback()
+        return None
+
+    tendie_cache.bumpDataVersion(userID)
     db.commit()
+    tendie_suggest.unlearnExpenses([expense], userID)
 
     return result
 
 
 # Update an existing expense record for the user
+# Raises ValueError (from validateExpense) when the form's expense is invalid
 def updateExpense(oldExpense, formData, userID):
-    expense = {"description": None, "category": None,
-               "date": None, "amount": None, "payer": None}
-    expense["description"] = formData.get("description").strip()
-    expense["category"] = formData.get("category").strip()
-    expense["date"] = formData.get("date").strip()
-    expense["amount"] = formData.get("amount").strip()
-    expense["payer"] = formData.get("payer").strip()
+    expense = {"description": formData.get("description"), "category": formData.get("category"),
+               "date": formData.get("date"), "amount": formData.get("amount"), "payer": formData.get("payer")}
 
-    # Convert the amount from string to float for the DB
-    expense["amount"] = float(expense["amount"])
+    # Validate the expense and convert the amount from string to float for the DB
+    validateExpense(expense)
 
     # Make sure the user actually is submitting changes and not saving the existing expense again
     hasChanges = False
@@ -134,17 +377,97 @@ def updateExpense(oldExpense, formData, userID):
     if hasChanges is False:
         return None
 
-    # Update the existing record
-    now = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
-    result = db.execute("UPDATE expenses SET description = :newDescription, category = :newCategory, expenseDate = :newDate, amount = :newAmount, payer = :newPayer, submitTime = :newSubmitTime WHERE id = :existingExpenseID AND user_id = :usersID",
-                        {"newDescription": expense["description"], "newCategory": expense["category"], "newDate": expense["date"], "newAmount": expense["amount"], "newPayer": expense["payer"], "newSubmitTime": now, "existingExpenseID": oldExpense["id"], "usersID": userID}).rowcount
+    # Update the existing record (and move its amount in the users spending rollup, all in the same transaction)
+    tendie_rollup.removeExpenses([oldExpense["id"]], userID)
+    now = datetime.now().replace(microsecond=0)
+    # Only update the version of the expense the user was editing (optimistic concurrency: another tab may have changed it since) and bump its version
+    result = db.execute("UPDATE expenses SET description = :newDescription, category = :newCategory, expenseDate = :newDate, amount = :newAmount, payer = :newPayer, submitTime = :newSubmitTime, version = version + 1 WHERE id = :existingExpenseID AND user_id = :usersID AND version = :version",
+                        {"newDescription": expense["description"], "newCategory": expense["category"], "newDate": expense["date"], "newAmount": expense["amount"], "newPayer": expense["payer"], "newSubmitTime": now, "existingExpenseID": oldExpense["id"], "usersID": userID, "version": oldExpense["formVersion"]}).rowcount
+    if not result:
+        db.rollback()
+        return None
+
+    tendie_rollup.addExpenses([oldExpense["id"]], userID)
+    tendie_cache.bumpDataVersion(userID)
     db.commit()
+    tendie_suggest.unlearnExpenses([oldExpense], userID)
+    tendie_suggest.learnExpenses([expense], userID)
 
-    # Make sure result is not empty (indicating it could not update the expense)
-    if result:
-        # Add dictionary to list (to comply with design/standard of expensed.html)
-        expenses = []
-        expenses.append(expense)
-        return expenses
-    else:
+    # Add dictionary to list (to comply with design/standard of expensed.html)
+    expenses = []
+    expenses.append(expense)
+    return expenses
+
+
+# Bulk actions for the users expenses (action -> SET clause). Values are validated in bulkUpdateExpenses
+BULK_ACTIONS = {"category": "category = :value", "payer": "payer = :value", "shiftdays": "expenseDate = expenseDate + :value", "delete": None}
+
+
+# Validate a bulk action and its value, returning the value to store (a category/payer the user has, or a number of days to shift by). Raises ValueError for invalid actions
+def validateBulkAction(action, value, userID):
+    if action not in BULK_ACTIONS:
+        raise ValueError(f"Unknown bulk action '{action}'")
+
+    if action == "delete":
         return None
+
+    value = (value or "").strip()
+    if not value:
+        raise ValueError(f"Bulk {action} change needs a new {action}")
+
+    if action == "category" and not tendie_categories.existsForUser(value, userID):
+        raise ValueError(f"'{value}' isn't one of your categories")
+    elif action == "payer" and not tendie_account.payerExistsForUser(value, userID):
+        raise ValueError(f"'{value}' isn't one of your payers")
+    elif action == "shiftdays":
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError("Dates must be shifted by a whole number of days")
+        if value == 0 or abs(value) > 3660:
+            raise ValueError("Dates can be shifted by 1 to 3660 days")
+
+    return value
+
+
+# Recategorise, change the payer of, shift the date of, or delete every expense matching the filters (an explicit selection of IDs and/or the history filters) and return the number of expenses affected
+# Query note: one set-based UPDATE/DELETE (plus the rollup adjustments) in a single transaction, regardless of how many expenses match
+# Without any filters the action applies to the users whole history, which has to be asked for explicitly with allExpenses=True
+def bulkUpdateExpenses(action, value, filters, userID, allExpenses=False):
+    value = validateBulkAction(action, value, userID)
+
+    if not any(filters.values()) and not allExpenses:
+        raise ValueError("Select or filter the expenses to change (or confirm changing all of them)")
+
+    where, params = getExpenseFilterSQL(filters, userID)
+
+    try:
+        # Lock the matching expenses first and work on exactly those IDs, so expenses added/changed by another request mid-way can't be counted in the rollup twice (or not at all)
+        results = db.execute(f"SELECT id FROM expenses WHERE {where} FOR UPDATE", params).fetchall()
+        expenseIDs = [result[0] for result in results]
+        if not expenseIDs:
+            db.rollback()
+            return 0
+
+        idParams = {"usersID": userID, "expenseIDs": expenseIDs, "value": value, "now": datetime.now().replace(microsecond=0)}
+        tendie_rollup.removeExpenses(expenseIDs, userID)
+        if action == "delete":
+            count = db.execute("DELETE FROM expenses WHERE user_id = :usersID AND id = ANY(:expenseIDs)", idParams).rowcount
+        else:
+            count = db.execute(f"UPDATE expenses SET {BULK_ACTIONS[action]}, submitTime = :now, version = version + 1 WHERE user_id = :usersID AND id = ANY(:expenseIDs)",
+                               idParams).rowcount
+            tendie_rollup.addExpenses(expenseIDs, userID)
+
+        tendie_cache.bumpDataVersion(userID)
+        db.commit()
+    except IntegrityError:
+        # Recurring expenses are unique per (recurring expense, date), so shifting them onto a date their recurring expense already has fails
+        db.rollback()
+        raise ValueError("Shifting these dates would give a recurring expense two expenses on the same date. Nothing was changed")
+    except Exception:
+        db.rollback()
+        raise
+
+    tendie_suggest.forgetModel(userID)
+
+    return count
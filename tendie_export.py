@@ -0,0 +1,84 @@
+import csv
+import io
+import json
+import os
+import tendie_expenses
+
+from sqlalchemy import text
+from tendie_db import engine
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", 2000))
+
+# Approximate size (bytes) of each chunk sent to the client
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Columns written to exports (in order)
+EXPORT_COLUMNS = ["id", "description", "category", "date", "payer", "amount", "submittime"]
+
+# Supported export formats (format -> mimetype)
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+# Stream the users expenses matching the filters (ordered by ID) from a server-side cursor, so memory use doesn't grow with the number of expenses
+# Uses its own connection rather than the request session because the rows are read after the view has returned (while the response streams)
+def streamExpenses(filters, userID):
+    where, params = tendie_expenses.getExpenseFilterSQL(filters, userID)
+
+    with engine.connect() as connection:
+        results = connection.execution_options(stream_results=True).execute(
+            text(f"SELECT id, description, category, expensedate AS date, payer, amount, submittime FROM expenses WHERE {where} ORDER BY id"), params)
+
+        while True:
+            rows = results.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+
+# Generate the export file in chunks for the format ('csv' or 'jsonl')
+def generateExport(fileFormat, rows):
+    if fileFormat == "csv":
+        return generateCSV(rows)
+    elif fileFormat == "jsonl":
+        return generateJSONL(rows)
+    else:
+        raise ValueError(f"Unsupported export format '{fileFormat}'")
+
+
+# Generate CSV (with a header row) in chunks of about EXPORT_CHUNK_BYTES
+def generateCSV(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+# Generate JSON Lines (one expense object per line) in chunks of about EXPORT_CHUNK_BYTES
+def generateJSONL(rows):
+    lines = []
+    size = 0
+
+    for row in rows:
+        expense = dict(zip(EXPORT_COLUMNS, row))
+        for key in ["date", "submittime"]:
+            if expense[key] is not None:
+                expense[key] = expense[key].isoformat()
+        line = json.dumps(expense) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(lines)
+            lines = []
+            size = 0
+
+    yield "".join(lines)
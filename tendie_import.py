@@ -0,0 +1,288 @@
+import csv
+import io
+import os
+import re
+import hashlib
+import tendie_account
+import tendie_cache
+import tendie_categories
+import tendie_expenses
+import tendie_rollup
+import tendie_suggest
+
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from tendie_db import db
+
+# Number of expenses written to the DB per COPY (memory use of an import is bounded by this, not by the size of the file)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 5000))
+
+# Number of recent expenses (per import) checked for repeats within the statement itself
+IMPORT_DEDUPE_WINDOW = int(os.getenv("IMPORT_DEDUPE_WINDOW", 100000))
+
+# Supported statement formats (file extension -> format)
+IMPORT_FORMATS = {"csv": "csv", "ofx": "ofx", "qfx": "ofx", "qif": "qif"}
+
+# CSV header names (lowercase) recognized for each expense field, in order of preference
+CSV_COLUMNS = {
+    "date": ["date", "transaction date", "trans. date", "posted date", "posting date", "post date"],
+    "description": ["description", "payee", "name", "merchant", "details", "memo"],
+    "amount": ["amount", "debit", "transaction amount"],
+    "credit": ["credit"],
+    "category": ["category"],
+    "payer": ["payer"]
+}
+
+# Date formats tried (in order) for CSV and QIF statements
+DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%m-%d-%Y", "%Y/%m/%d", "%Y%m%d"]
+
+
+# Import pipeline: parse -> normalise -> map category/payer -> dedupe -> batch -> COPY
+# Each stage is a generator so only one batch of expenses is held in memory at a time
+# duplicateMode controls expenses that are already in the users history: 'skip' them, 'count' them (import them, counting how many were already there) or 'off' (don't check)
+def importExpenses(lines, fileFormat, userID, defaultCategory=None, dedupe=True, batchSize=IMPORT_BATCH_SIZE, duplicateMode="skip"):
+    summary = {"imported": 0, "skipped": 0, "duplicates": 0, "existing": 0, "skippedExisting": duplicateMode == "skip", "errors": []}
+
+    if fileFormat not in IMPORT_FORMATS.values():
+        raise ValueError(f"Unsupported statement format '{fileFormat}'")
+    if duplicateMode not in ("skip", "count", "off"):
+        raise ValueError(f"Unknown duplicate mode '{duplicateMode}'")
+
+    # OFX/QIF statements use negative amounts for spending, CSV exports are treated as a list of expenses (sign ignored)
+    debitsNegative = fileFormat != "csv"
+
+    parsers = {"csv": parseCSV, "ofx": parseOFX, "qif": parseQIF}
+    rows = parsers[fileFormat](lines)
+    rows = normaliseRows(rows, debitsNegative, summary)
+    rows = mapCategoriesAndPayers(rows, userID, defaultCategory)
+    if dedupe:
+        rows = dedupeRows(rows, summary)
+
+    # All batches are written in one transaction so a failed import doesn't leave half a statement behind
+    submitTime = datetime.now().replace(microsecond=0)
+    try:
+        for batch in batchRows(rows, batchSize):
+            # One fingerprint index probe per expense to find expenses that were already imported/entered
+            if duplicateMode != "off":
+                existing = tendie_expenses.findDuplicates(batch, userID)
+                summary["existing"] += len(existing)
+                if duplicateMode == "skip":
+                    batch = [expense for index, expense in enumerate(batch) if index not in existing]
+                if not batch:
+                    continue
+
+            copyExpenses(batch, userID, submitTime)
+            summary["imported"] += len(batch)
+
+        tendie_cache.bumpDataVersion(userID)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    tendie_suggest.forgetModel(userID)
+
+    return summary
+
+
+# Get the statement format for a file name based on its extension (None if unsupported)
+def getFileFormat(fileName):
+    extension = os.path.splitext(fileName or "")[1].lower().lstrip(".")
+
+    return IMPORT_FORMATS.get(extension)
+
+
+# Parse a CSV statement with a header row into raw rows
+def parseCSV(lines):
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if not header:
+        return
+
+    # Find the column index of each expense field by its header name
+    header = [name.strip().lower() for name in header]
+    columns = {}
+    for field, names in CSV_COLUMNS.items():
+        for name in names:
+            if name in header:
+                columns[field] = header.index(name)
+                break
+
+    if "date" not in columns or "description" not in columns or ("amount" not in columns and "credit" not in columns):
+        raise ValueError("CSV statements need a header row with date, description and amount columns")
+
+    for line in reader:
+        if not line:
+            continue
+
+        row = {}
+        for field, index in columns.items():
+            row[field] = line[index] if index < len(line) else ""
+
+        # Separate debit/credit columns: a row with only a credit is money coming in, so flag it to be skipped
+        row["credit"] = bool(row.get("credit", "").strip()) and not row.get("amount", "").strip()
+
+        yield row
+
+
+# Parse an OFX/QFX statement (SGML or XML flavour) into raw rows, one per <STMTTRN> transaction
+def parseOFX(lines):
+    transaction = None
+    for line in lines:
+        # Tags can be on one line or split across lines, so process every tag in the line
+        for tag, value in re.findall(r"<([A-Za-z0-9./]+)>([^<\r\n]*)", line):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                transaction = {}
+            elif tag == "/STMTTRN" and transaction is not None:
+                description = transaction.get("NAME") or transaction.get("PAYEE") or transaction.get("MEMO") or ""
+                yield {"date": transaction.get("DTPOSTED", "")[:8], "description": description, "amount": transaction.get("TRNAMT", "")}
+                transaction = None
+            elif transaction is not None and value.strip():
+                transaction[tag] = value.strip()
+
+
+# Parse a QIF statement into raw rows, one per '^' terminated record
+def parseQIF(lines):
+    record = {}
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line or line.startswith("!"):
+            continue
+
+        code, value = line[0], line[1:].strip()
+        if code == "^":
+            if record:
+                yield {"date": record.get("D", ""), "description": record.get("P") or record.get("M") or "",
+                       "amount": record.get("T") or record.get("U") or "", "category": record.get("L", "")}
+            record = {}
+        else:
+            record[code] = value
+
+
+# Parse a statement date string (QIF uses e.g. 04/13'20 for 2020)
+def parseDate(value):
+    value = value.strip().replace("'", "/").replace(" ", "")
+    for dateFormat in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, dateFormat).date()
+        except ValueError:
+            continue
+
+    raise ValueError(f"Unrecognized date '{value}'")
+
+
+# Parse a statement amount string like '$1,234.56', '-12.00' or '(12.00)'
+def parseAmount(value):
+    value = value.strip().replace("$", "").replace(",", "")
+    if value.startswith("(") and value.endswith(")"):
+        value = "-" + value[1:-1]
+
+    return float(value)
+
+
+# Normalise raw rows into expenses (dates, amounts, descriptions) using the same validation as expenses added in the app. Rows that can't be normalised are skipped and counted
+def normaliseRows(rows, debitsNegative, summary):
+    for lineNumber, row in enumerate(rows, start=1):
+        if row.get("credit"):
+            summary["skipped"] += 1
+            continue
+
+        try:
+            amount = parseAmount(row.get("amount", ""))
+
+            # Skip money coming in (deposits/refunds) when spending is recorded as negative amounts
+            if debitsNegative:
+                if amount >= 0:
+                    summary["skipped"] += 1
+                    continue
+                amount = -amount
+
+            expense = {"description": " ".join(row.get("description", "").split())[:200], "category": row.get("category", "").strip(),
+                       "date": parseDate(row.get("date", "")).isoformat(), "amount": round(abs(amount), 2), "payer": row.get("payer", "").strip()}
+
+            # Category and payer are mapped to the users own names in the next stage, so only validate them after mapping
+            expense["category"] = expense["category"] or "-"
+            expense["payer"] = expense["payer"] or "-"
+            tendie_expenses.validateExpense(expense)
+        except ValueError as error:
+            summary["skipped"] += 1
+            # Only keep the first few errors so a bad file doesn't fill memory with messages
+            if len(summary["errors"]) < 10:
+                summary["errors"].append(f"Row {lineNumber}: {error}")
+            continue
+
+        if expense["amount"] == 0:
+            summary["skipped"] += 1
+            continue
+
+        yield expense
+
+
+# Map each expenses category/payer to one of the users categories/payers (case insensitive), falling back to the default category and 'Self'
+def mapCategoriesAndPayers(rows, userID, defaultCategory=None):
+    categories = {category["name"].lower(): category["name"] for category in tendie_categories.getSpendCategories(userID)}
+    payers = {payer["name"].lower(): payer["name"] for payer in tendie_account.getPayers(userID)}
+    payers["self"] = "Self"
+
+    # Default to the users 'Other' category if they have one, otherwise their first category
+    if not defaultCategory or defaultCategory.lower() not in categories:
+        defaultCategory = categories.get("other") or next(iter(categories.values()), "Other")
+    else:
+        defaultCategory = categories[defaultCategory.lower()]
+
+    for expense in rows:
+        expense["category"] = categories.get(expense["category"].lower(), defaultCategory)
+        expense["payer"] = payers.get(expense["payer"].lower(), "Self")
+        yield expense
+
+
+# Drop expenses that appear more than once in the same statement (same date, amount, description, category and payer)
+# Only 64-bit digests of the last IMPORT_DEDUPE_WINDOW expenses are kept, so memory is capped at a few MB whatever the size of the file
+# Repeats further apart than the window (statements are usually in date order, so they're rare) are still found by the fingerprint check against expenses already written, unless duplicateMode is 'off'
+def dedupeRows(rows, summary, window=IMPORT_DEDUPE_WINDOW):
+    seen = set()
+    recent = deque()
+    for expense in rows:
+        key = "\x1f".join([expense["date"], f"{expense['amount']:.2f}", expense["description"].lower(), expense["category"], expense["payer"]])
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        if digest in seen:
+            summary["duplicates"] += 1
+            continue
+
+        seen.add(digest)
+        recent.append(digest)
+        if len(recent) > window:
+            seen.discard(recent.popleft())
+        yield expense
+
+
+# Group expenses into lists of batchSize
+def batchRows(rows, batchSize):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batchSize))
+        if not batch:
+            return
+        yield batch
+
+
+# Write a batch of expenses for the user with Postgres COPY (in the sessions transaction) and add them to the users spending rollup
+def copyExpenses(batch, userID, submitTime):
+    # Reserve the batches expense IDs up front so the rollup can be updated for exactly these rows (COPY can't return them)
+    results = db.execute("SELECT nextval(pg_get_serial_sequence('expenses', 'id')) FROM generate_series(1, :count)",
+                         {"count": len(batch)}).fetchall()
+    expenseIDs = [result[0] for result in results]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for expenseID, expense in zip(expenseIDs, batch):
+        writer.writerow([expenseID, expense["description"], expense["category"], expense["date"], expense["amount"], expense["payer"], submitTime, userID])
+    buffer.seek(0)
+
+    cursor = db.connection().connection.cursor()
+    cursor.copy_expert(
+        "COPY expenses (id, description, category, expensedate, amount, payer, submittime, user_id) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    tendie_rollup.addExpenses(expenseIDs, userID)
@@ -0,0 +1,175 @@
+import calendar
+import logging
+import os
+import socket
+import threading
+import time
+import tendie_cache
+import tendie_expenses
+import tendie_suggest
+
+from datetime import date, timedelta
+from helpers import convertSQLToDict
+from tendie_db import db, acquireLease, releaseLease
+
+# Supported schedules (every 'interval' days/weeks/months/years)
+FREQUENCIES = ["daily", "weekly", "monthly", "yearly"]
+
+# Max occurrences written per recurring expense in one pass (a long outage is caught up over several passes)
+MAX_OCCURRENCES_PER_PASS = 1000
+
+# How often (seconds) each worker checks for due recurring expenses, and how long the lease for a pass lasts
+SCHEDULER_INTERVAL = int(os.getenv("RECURRING_SCHEDULER_INTERVAL", 3600))
+LEASE_SECONDS = 300
+
+# Name of this process for the scheduler lease
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+logger = logging.getLogger(__name__)
+
+
+# Get and return the users recurring expenses
+def getRecurringExpenses(userID):
+    results = db.execute("SELECT id, description, category, amount, payer, frequency, interval, startdate, enddate, nextdate FROM recurringexpenses WHERE user_id = :usersID AND active ORDER BY nextdate, id",
+                         {"usersID": userID}).fetchall()
+
+    return convertSQLToDict(results)
+
+
+# Add a recurring expense for the user from the HTML form. Occurrences up to today are written by the next scheduler pass
+def addRecurringExpense(formData, userID):
+    expense = {"description": formData.get("description", ""), "category": formData.get("category", ""),
+               "date": formData.get("startdate", ""), "amount": formData.get("amount", ""), "payer": formData.get("payer", "")}
+    tendie_expenses.validateExpense(expense)
+
+    frequency = formData.get("frequency", "")
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Unknown frequency '{frequency}'")
+    interval = int(formData.get("interval") or 1)
+    if interval < 1:
+        raise ValueError("Interval must be at least 1")
+    startDate = date.fromisoformat(expense["date"])
+    endDate = date.fromisoformat(formData.get("enddate")) if formData.get("enddate") else None
+    if endDate and endDate < startDate:
+        raise ValueError("End date can't be before the start date")
+
+    recurringID = db.execute("INSERT INTO recurringexpenses (user_id, description, category, amount, payer, frequency, interval, startdate, enddate, nextdate) VALUES (:usersID, :description, :category, :amount, :payer, :frequency, :interval, :startDate, :endDate, :startDate) RETURNING id",
+                             {"usersID": userID, "description": expense["description"], "category": expense["category"], "amount": expense["amount"], "payer": expense["payer"],
+                              "frequency": frequency, "interval": interval, "startDate": startDate, "endDate": endDate}).fetchone()[0]
+    db.commit()
+
+    return recurringID
+
+
+# Stop a recurring expense (expenses it already wrote are kept)
+def deleteRecurringExpense(recurringID, userID):
+    rows = db.execute("UPDATE recurringexpenses SET active = false WHERE id = :recurringID AND user_id = :usersID",
+                      {"recurringID": recurringID, "usersID": userID}).rowcount
+    db.commit()
+
+    return rows
+
+
+# Get the date of the nth occurrence of a schedule. Months/years are counted from the start date so e.g. the 31st falls on the last day of shorter months without drifting
+def getOccurrence(startDate, frequency, interval, n):
+    if frequency == "daily":
+        return startDate + timedelta(days=n * interval)
+    elif frequency == "weekly":
+        return startDate + timedelta(weeks=n * interval)
+
+    months = n * interval * (12 if frequency == "yearly" else 1)
+    year, month = divmod(startDate.month - 1 + months, 12)
+    year += startDate.year
+    day = min(startDate.day, calendar.monthrange(year, month + 1)[1])
+
+    return date(year, month + 1, day)
+
+
+# Get the due occurrence dates (nextdate thru today, not past the end date) of a recurring expense and the next date after them
+def getDueOccurrences(recurring, today):
+    startDate, frequency, interval = recurring["startdate"], recurring["frequency"], recurring["interval"]
+    lastDate = min(today, recurring["enddate"]) if recurring["enddate"] else today
+
+    # Find the index of the occurrence on/after nextdate
+    if frequency in ("daily", "weekly"):
+        step = interval * (7 if frequency == "weekly" else 1)
+        n = -(-(recurring["nextdate"] - startDate).days // step)
+    else:
+        step = interval * (12 if frequency == "yearly" else 1)
+        n = ((recurring["nextdate"].year - startDate.year) * 12 + recurring["nextdate"].month - startDate.month) // step
+    n = max(n, 0)
+    while getOccurrence(startDate, frequency, interval, n) < recurring["nextdate"]:
+        n += 1
+
+    dates = []
+    occurrence = getOccurrence(startDate, frequency, interval, n)
+    while occurrence <= lastDate and len(dates) < MAX_OCCURRENCES_PER_PASS:
+        dates.append(occurrence)
+        n += 1
+        occurrence = getOccurrence(startDate, frequency, interval, n)
+
+    return dates, occurrence
+
+
+# Write every due occurrence of every users recurring expenses to expenses in one transaction and return the number of expenses written
+# Safe to run from every worker at once and after restarts: a lease means only one process does a pass, due definitions are locked (SKIP LOCKED), and each occurrence is unique per (recurring expense, date) so it's never written twice
+def materialiseDueExpenses(today=None):
+    today = today or date.today()
+    if not acquireLease("recurringexpenses", LEASE_OWNER, LEASE_SECONDS):
+        return 0
+
+    written = 0
+    try:
+        results = db.execute("SELECT id, user_id, description, category, amount, payer, frequency, interval, startdate, enddate, nextdate FROM recurringexpenses WHERE active AND nextdate <= :today ORDER BY user_id FOR UPDATE SKIP LOCKED",
+                             {"today": today}).fetchall()
+
+        # Build each users due expenses and the next date of each definition
+        expensesByUser = {}
+        nextDates = []
+        for recurring in convertSQLToDict(results):
+            dates, nextDate = getDueOccurrences(recurring, today)
+            for occurrence in dates:
+                expense = {"description": recurring["description"], "category": recurring["category"], "date": occurrence.isoformat(),
+                           "amount": recurring["amount"], "payer": recurring["payer"], "recurringID": recurring["id"]}
+                expensesByUser.setdefault(recurring["user_id"], []).append(tendie_expenses.validateExpense(expense))
+            nextDates.append({"recurringID": recurring["id"], "nextDate": nextDate,
+                              "active": not recurring["enddate"] or nextDate <= recurring["enddate"]})
+
+        # Same insert path as expenses added by users (multi-row INSERTs + rollup), one batch per user
+        for userID, expenses in expensesByUser.items():
+            written += len(tendie_expenses.writeExpenses(expenses, userID))
+            tendie_cache.bumpDataVersion(userID)
+
+        for nextDate in nextDates:
+            db.execute("UPDATE recurringexpenses SET nextdate = :nextDate, active = :active WHERE id = :recurringID", nextDate)
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        releaseLease("recurringexpenses", LEASE_OWNER)
+
+    for userID in expensesByUser:
+        tendie_suggest.forgetModel(userID)
+
+    return written
+
+
+# Run materialiseDueExpenses every SCHEDULER_INTERVAL seconds in a background thread of this process (each gunicorn worker runs one, the lease keeps them from doing the same work)
+# Started by the gunicorn worker hook in gunicorn.conf.py, so 'flask' CLI commands (which import the app too) never run it
+def startScheduler():
+    def run():
+        while True:
+            try:
+                materialiseDueExpenses()
+            except Exception:
+                logger.exception("Recurring expense scheduler failed")
+            finally:
+                db.remove()
+            time.sleep(SCHEDULER_INTERVAL)
+
+    thread = threading.Thread(target=run, name="recurring-expenses", daemon=True)
+    thread.start()
+
+    return thread
@@ -1,49 +1,58 @@
-import os
+import json
+import time
 import calendar
-import copy
+import tendie_cache
+import tendie_rollup
 import tendie_expenses
 import tendie_dashboard
 import tendie_categories
-import tendie_budgets
 
 from flask import request, session
 from flask_session import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
-from helpers import convertSQLToDict
-from datetime import datetime
+from helpers import convertSQLToDict, yearRange
+from tendie_db import db
+from datetime import date, datetime, timedelta
 
-# Create engine object to manage connections to DB, and scoped session to separate user interactions with DB
-engine = create_engine(os.getenv("DATABASE_URL"))
-db = scoped_session(sessionmaker(bind=engine))
 
-
-# Generates data needed for the budget report by looping through each budget and adding expense history where categories match between budgets and expenses
-# TODO: This data/reporting becomes less beneficial when users have multiple budgets that have the same categories checked because 1 expense with 'Category A' will be associated with for example 3 budgets that have 'Category A' checked
+# Generates data needed for the budget report: every budget of the year with its spent amount and the expenses in its categories
+# Note: 1 expense with 'Category A' is listed under every budget that has 'Category A' checked (it's only fetched/stored once and shared between those budgets)
+# Query note: one query returns (budget, expense) pairs plus each budgets total (window SUM), and the pairs are grouped in a single pass below
 def generateBudgetsReport(userID, year=None):
-    # Create data structure to hold users category spending data
-    budgetsReport = []
-
     # Default to getting current years budgets
     if not year:
         year = datetime.now().year
 
-    # Get every budgets spent/remaining for the user
-    budgetsReport = tendie_dashboard.getBudgets(userID, year)
+    start, end = yearRange(year)
+    results = db.execute(
+        "WITH userbudgets AS (SELECT id, name, amount FROM budgets WHERE user_id = :usersID AND year = :year), budgetcategorynames AS (SELECT DISTINCT budgetcategories.budgets_id, categories.name FROM budgetcategories INNER JOIN categories ON budgetcategories.category_id = categories.id WHERE budgetcategories.budgets_id IN (SELECT id FROM userbudgets)), budgetexpenses AS (SELECT id, description, category, expensedate, payer, amount FROM expenses WHERE user_id = :usersID AND expensedate >= :start AND expensedate < :end AND category IN (SELECT name FROM budgetcategorynames)) SELECT userbudgets.id AS budgetid, userbudgets.name, userbudgets.amount, SUM(budgetexpenses.amount) OVER (PARTITION BY userbudgets.id) AS spent, budgetexpenses.id AS expenseid, budgetexpenses.description, budgetexpenses.category, budgetexpenses.expensedate, budgetexpenses.payer, budgetexpenses.amount AS expenseamount FROM userbudgets LEFT JOIN budgetcategorynames ON budgetcategorynames.budgets_id = userbudgets.id LEFT JOIN budgetexpenses ON budgetexpenses.category = budgetcategorynames.name ORDER BY userbudgets.name ASC, userbudgets.id, budgetexpenses.id",
+        {"usersID": userID, "year": year, "start": start, "end": end}).fetchall()
 
-    # Loop through the budgets and add a new key/value pair to hold expense details per budget
-    if budgetsReport:
-        for record in budgetsReport:
-            budgetID = tendie_budgets.getBudgetID(record["name"], userID)
-            results = db.execute("SELECT expenses.description, expenses.category, expenses.expenseDate, expenses.payer, expenses.amount FROM expenses WHERE user_id = :usersID AND date_part('year', date(expensedate)) = :year AND category IN (SELECT categories.name FROM budgetcategories INNER JOIN categories on budgetcategories.category_id = categories.id WHERE budgetcategories.budgets_id = :budgetID)",
-                                 {"usersID": userID, "year": year, "budgetID": budgetID}).fetchall()
-            expenseDetails = convertSQLToDict(results)
-            record["expenses"] = expenseDetails
+    # Group the rows by budget (rows are ordered by budget so each budget is started once)
+    budgetsReport = []
+    expenses = {}
+    budget = None
+    for row in results:
+        if budget is None or budget["id"] != row["budgetid"]:
+            budget = {"id": row["budgetid"], "name": row["name"], "amount": row["amount"], "spent": row["spent"], "expenses": []}
+            budgetsReport.append(budget)
+
+        # Budgets without any expenses have a single row with no expense
+        if row["expenseid"] is not None:
+            expense = expenses.get(row["expenseid"])
+            if expense is None:
+                expense = expenses[row["expenseid"]] = {"description": row["description"], "category": row["category"], "expensedate": row["expensedate"],
+                                                        "payer": row["payer"], "amount": row["expenseamount"]}
+            budget["expenses"].append(expense)
+
+    # Return None if no budget was found
+    if not budgetsReport:
+        return None
 
-    return budgetsReport
+    return tendie_dashboard.buildBudgets(budgetsReport)
 
 
 # Generates data needed for the monthly spending report
+# The table of the years individual expenses isn't part of the report: the page loads it one page at a time from /expensehistory/data (filtered to the year), so the report's size doesn't depend on how many expenses the user has
 def generateMonthlyReport(userID, year=None):
 
     # Default to getting current years reports
@@ -53,14 +62,13 @@ def generateMonthlyReport(userID, year=None):
     # Create data structure to hold users monthly spending data for the chart (monthly summed data)
     spending_month_chart = tendie_dashboard.getMonthlySpending(userID, year)
 
-    # Get the spending data from DB for the table (individual expenses per month)
-    results = db.execute(
-        "SELECT description, category, expensedate, amount, payer FROM expenses WHERE user_id = :usersID AND date_part('year', date(expensedate)) = :year ORDER BY id ASC", {"usersID": userID, "year": year}).fetchall()
-    spending_month_table = convertSQLToDict(results)
+    # Table filters for the year (inclusive dates, as used by the expense history filters)
+    start, end = yearRange(year)
+    tableFilters = {"startDate": start.isoformat(), "endDate": (end - timedelta(days=1)).isoformat()}
 
-    # Combine both data points (chart and table) into a single data structure
+    # Combine both data points (chart and table) into a single data structure (the table has expenses when the chart has spending)
     monthlyReport = {"chart": spending_month_chart,
-                     "table": spending_month_table}
+                     "table": tableFilters if spending_month_chart else None}
 
     return monthlyReport
 
@@ -72,78 +80,51 @@ def generateSpendingTrendsReport(userID, year=None):
     if not year:
         year = datetime.now().year
 
-    # Get chart data for spending trends
-    spending_trends_chart = tendie_dashboard.getSpendingTrends(userID, year)
-
-    # Data structure for spending trends table
-    categories = []
-    category = {"name": None, "expenseMonth": 0,
-                "expenseCount": 0, "amount": 0}
-    spending_trends_table = {
-        "January": [],
-        "February": [],
-        "March": [],
-        "April": [],
-        "May": [],
-        "June": [],
-        "July": [],
-        "August": [],
-        "September": [],
-        "October": [],
-        "November": [],
-        "December": []
-    }
+    # Get all of the users categories first (doesn't include old categories the user deleted but are still tracked in Expenses), then any categories that are in expenses but no longer exist as a selectable category for the user (because they deleted the category)
+    categoryNames = [category["name"] for category in tendie_categories.getSpendCategories(userID)]
+    categoryNames += [category["category"] for category in tendie_categories.getSpendCategories_Inactive(userID)]
 
-    # Get all of the users categories first (doesn't include old categories the user deleted but are still tracked in Expenses)
-    categories_active = tendie_categories.getSpendCategories(userID)
+    # Month x category matrix of amounts/counts, addressed by a category name -> column index dict so each DB row is an O(1) cell update
+    columns = {name: column for column, name in enumerate(categoryNames)}
+    amounts = [[0] * len(categoryNames) for month in range(12)]
+    counts = [[0] * len(categoryNames) for month in range(12)]
 
-    # Get any categories that are in expenses but no longer exist as a selectable category for the user (because they deleted the category)
-    categories_inactive = tendie_categories.getSpendCategories_Inactive(userID)
-
-    # First fill using the users current categories, and then inactive categories from Expenses
-    for activeCategory in categories_active:
-        category["name"] = activeCategory["name"]
-        categories.append(category.copy())
-
-    for inactiveCategory in categories_inactive:
-        category["name"] = inactiveCategory["category"]
-        categories.append(category.copy())
-
-    # Place a deep copy of the categories into each month (need deep copy here because every category may have unique spend data month to month. TODO: optimize this for memory/performance later)
-    for month in spending_trends_table.keys():
-        spending_trends_table[month] = copy.deepcopy(categories)
-
-    # Get expense data for each category by month (retrieves the total amount of expenses per category by month, and the total count of expenses per category by month. Assumes there is at least 1 expense for the category)
+    # Get expense data for each category by month (the total amount and count of expenses per category by month)
     results = db.execute(
-        "SELECT date_part('month', date(expensedate)) AS monthofcategoryexpense, category AS name, COUNT(category) AS count, SUM(amount) AS amount FROM expenses WHERE user_id = :usersID AND date_part('year', date(expensedate)) = :year GROUP BY date_part('month', date(expensedate)), category ORDER BY COUNT(category) DESC",
+        "SELECT month, category, SUM(count)::integer AS count, SUM(amount) AS amount FROM spendingrollup WHERE user_id = :usersID AND year = :year GROUP BY month, category",
         {"usersID": userID, "year": year}).fetchall()
 
-    spending_trends_table_query = convertSQLToDict(results)
-
-    # Loop thru each monthly category expense from above DB query and update the data structure that holds all monthly category expenses
-    for categoryExpense in spending_trends_table_query:
-        # Get the key (month) for the data structure
-        monthOfExpense = calendar.month_name[int(
-            categoryExpense["monthofcategoryexpense"])]
-        # Traverse the data structure: 1) go to the dict month based on the category expense date, 2) loop thru each dict category until a match in name occurs with the expense, 3) update the dict month/amount/count properties to match the DB record
-        for category in spending_trends_table[monthOfExpense]:
-            if category["name"] == categoryExpense["name"]:
-                category["expenseMonth"] = categoryExpense["monthofcategoryexpense"]
-                category["expenseCount"] = categoryExpense["count"]
-                category["amount"] = categoryExpense["amount"]
-                break
-            else:
-                continue
-
-    # Calculates and stores the amount spent per category for the table (note: can't get this to work in jinja with the spending_trends_table dict because of how jinja scopes variables. TODO: rethink data-structure to combine these)
-    numberOfCategories = len(categories)
-    categoryTotal = 0
-    # Loops through every month per category and sums up the monthly amounts
-    for i in range(numberOfCategories):
-        for month in spending_trends_table.keys():
-            categoryTotal += spending_trends_table[month][i]["amount"]
-        categories[i]["amount"] = categoryTotal
-        categoryTotal = 0
+    for month, category, count, amount in results:
+        column = columns.get(category)
+        if column is None:
+            # Category changed between the category queries and this one, give it a column rather than drop its spending
+            column = columns[category] = len(categoryNames)
+            categoryNames.append(category)
+            for monthRow in range(12):
+                amounts[monthRow].append(0)
+                counts[monthRow].append(0)
+        amounts[int(month) - 1][column] = amount
+        counts[int(month) - 1][column] = count
+
+    # Column (category) totals for the table footer and the chart
+    categoryAmounts = [sum(column) for column in zip(*amounts)]
+    categoryCounts = [sum(column) for column in zip(*counts)]
+
+    # Table: each month has one cell per category (in the same order as the categories/footer)
+    spending_trends_table = {}
+    for month in range(12):
+        spending_trends_table[calendar.month_name[month + 1]] = [
+            {"name": name, "expenseMonth": month + 1 if counts[month][column] else 0, "expenseCount": counts[month][column], "amount": amounts[month][column]}
+            for column, name in enumerate(categoryNames)]
+
+    categories = [{"name": name, "expenseMonth": 0, "expenseCount": 0, "amount": categoryAmounts[column]}
+                  for column, name in enumerate(categoryNames)]
+
+    # Chart data for spending trends comes from the same totals (categories with spending, most expenses first)
+    categoryTotals = [{"category": name, "count": categoryCounts[column], "amount": categoryAmounts[column]}
+                      for column, name in enumerate(categoryNames) if categoryCounts[column]]
+    categoryTotals.sort(key=lambda category: category["count"], reverse=True)
+    spending_trends_chart = tendie_dashboard.buildSpendingTrends(categoryTotals)
 
     # Combine both data points (chart, table, categories) into a single data structure
     spendingTrendsReport = {"chart": spending_trends_chart,
@@ -152,38 +133,197 @@ def generateSpendingTrendsReport(userID, year=None):
     return spendingTrendsReport
 
 
-# Generates data needed for the payers spending report
+# Generates data needed for the payers spending report (the same payers spending query the dashboard uses)
 def generatePayersReport(userID, year=None):
 
     # Default to getting current years reports
     if not year:
         year = datetime.now().year
 
-    # First get all of the payers from expenses table (this may include payers that don't exist anymore for the user (i.e. deleted the payer and didn't update expense records))
-    results_payers = db.execute(
-        "SELECT payer AS name, SUM(amount) AS amount FROM expenses WHERE user_id = :usersID AND date_part('year', date(expensedate)) = :year GROUP BY payer ORDER BY amount DESC", {"usersID": userID, "year": year}).fetchall()
-    payers = convertSQLToDict(results_payers)
+    return tendie_dashboard.getPayersSpending(userID, year)
+
+
+# Max number of near-duplicate pairs shown in the duplicates report
+DUPLICATES_REPORT_LIMIT = 500
+
+
+# Generates the near-duplicate expenses report: pairs of expenses with the same normalised description whose dates are within 'days' of each other and amounts within 'cents' of each other
+# Query note: each expense probes the (user_id, descriptionkey, expensedate) index for its matches instead of comparing every pair of expenses
+def generateDuplicatesReport(userID, days=3, cents=0):
+    results = db.execute(
+        "SELECT expense.id, expense.description, expense.category, expense.expensedate AS date, expense.payer, expense.amount, other.id AS otherid, other.description AS otherdescription, other.category AS othercategory, other.expensedate AS otherdate, other.payer AS otherpayer, other.amount AS otheramount FROM expenses AS expense INNER JOIN expenses AS other ON other.user_id = expense.user_id AND other.descriptionkey = expense.descriptionkey AND other.expensedate >= expense.expensedate AND other.expensedate <= expense.expensedate + :days AND (other.expensedate > expense.expensedate OR other.id > expense.id) AND abs(round(other.amount::float8::numeric * 100) - round(expense.amount::float8::numeric * 100)) <= :cents WHERE expense.user_id = :usersID ORDER BY expense.expensedate DESC, expense.id DESC LIMIT :limit",
+        {"usersID": userID, "days": days, "cents": cents, "limit": DUPLICATES_REPORT_LIMIT}).fetchall()
+
+    return convertSQLToDict(results)
+
+
+# Generates the year-over-year / multi-year comparison report for the years (any number of years, compared in ascending order)
+# Query note: one grouped query over the spending rollup returns the (year, month, category, payer) cube for every year at once, which is then pivoted in memory (no per-year queries)
+def generateCompareReport(userID, years):
+    years = sorted(set(years))
+
+    results = db.execute(
+        "SELECT year, month, category, payer, SUM(count)::integer AS count, SUM(amount) AS amount FROM spendingrollup WHERE user_id = :usersID AND year = ANY(:years) GROUP BY year, month, category, payer",
+        {"usersID": userID, "years": years}).fetchall()
+
+    # Pivot the cube into amounts per year for each total/month/category/payer (a list with one amount per year, in the order of years)
+    yearColumns = {year: column for column, year in enumerate(years)}
+    totals = [0] * len(years)
+    months = {month: [0] * len(years) for month in range(1, 13)}
+    categories = {}
+    payers = {}
+    for year, month, category, payer, count, amount in results:
+        column = yearColumns[year]
+        totals[column] += amount
+        months[month][column] += amount
+        categories.setdefault(category, [0] * len(years))[column] += amount
+        payers.setdefault(payer, [0] * len(years))[column] += amount
+
+    # Largest categories/payers (by the latest year, then earlier years) first
+    def byLatestYear(item):
+        return tuple(reversed(item[1]))
+
+    compareReport = {
+        "years": years,
+        "totals": buildComparison("Total", totals),
+        "months": [buildComparison(calendar.month_name[month], amounts) for month, amounts in months.items()],
+        "categories": [buildComparison(name, amounts) for name, amounts in sorted(categories.items(), key=byLatestYear, reverse=True)],
+        "payers": [buildComparison(name, amounts) for name, amounts in sorted(payers.items(), key=byLatestYear, reverse=True)]
+    }
+
+    return compareReport
+
+
+# Build a comparison row: the amount for each year plus the change from the previous year (delta in $ and growth in %, None for the first year or when the previous year had no spending)
+def buildComparison(name, amounts):
+    deltas = [None]
+    growth = [None]
+    for previous, amount in zip(amounts, amounts[1:]):
+        deltas.append(amount - previous)
+        growth.append(round((amount - previous) / previous * 100, 1) if previous else None)
+
+    return {"name": name, "amounts": amounts, "deltas": deltas, "growth": growth}
+
+
+# Max number of days in a date range report
+RANGE_REPORT_MAX_DAYS = 3660
 
-    # Now get any payers the user has in their account but haven't expensed anything
-    results_nonExpensePayers = db.execute(
-        "SELECT name FROM payers WHERE user_id = :usersID AND name NOT IN (SELECT payer FROM expenses WHERE expenses.user_id = :usersID AND date_part('year', date(expensedate)) = :year)", {"usersID": userID, "year": year}).fetchall()
-    nonExpensePayers = convertSQLToDict(results_nonExpensePayers)
+# Named date ranges for the range report (name -> (label, function returning the (start, end) range for today, end exclusive))
+RANGE_PRESETS = {
+    "mtd": ("Month to date", lambda today: (today.replace(day=1), today + timedelta(days=1))),
+    "qtd": ("Quarter to date", lambda today: (date(today.year, (today.month - 1) // 3 * 3 + 1, 1), today + timedelta(days=1))),
+    "ytd": ("Year to date", lambda today: (date(today.year, 1, 1), today + timedelta(days=1))),
+    "last30": ("Last 30 days", lambda today: (today - timedelta(days=29), today + timedelta(days=1))),
+    "last90": ("Last 90 days", lambda today: (today - timedelta(days=89), today + timedelta(days=1))),
+    "last365": ("Last 365 days", lambda today: (today - timedelta(days=364), today + timedelta(days=1)))
+}
 
-    # Add the non-expense payers to the payers data structure and set their amounts to 0
-    for payer in nonExpensePayers:
-        newPayer = {"name": payer["name"], "amount": 0}
-        payers.append(newPayer)
 
-    # Calculate the total paid for all payers combined
-    totalPaid = 0
-    for payer in payers:
-        totalPaid = totalPaid + payer["amount"]
+# Generates the totals and counts of the users expenses dated start thru end (exclusive) grouped by day, week, month, quarter, category or payer
+# Time groups are listed in date order, category/payer groups by amount (largest first)
+def generateRangeReport(userID, start, end, groupBy):
+    if end <= start or (end - start).days > RANGE_REPORT_MAX_DAYS:
+        raise ValueError(f"Date ranges must be 1 to {RANGE_REPORT_MAX_DAYS} days")
 
-    # Calculate the % paid per payer and add to the data structure
-    if totalPaid != 0:
-        for payer in payers:
-            payer["percentAmount"] = round((payer["amount"] / totalPaid) * 100)
+    totals = tendie_rollup.getRangeTotals(userID, start, end, groupBy)
+    amount = sum(total["amount"] for total in totals.values())
 
-        return payers
+    groups = []
+    for key, total in totals.items():
+        groups.append({"key": str(key), "name": getRangeGroupName(key, groupBy), "count": total["count"], "amount": total["amount"],
+                       "percentAmount": round(total["amount"] / amount * 100) if amount else 0})
+
+    if groupBy in ("category", "payer"):
+        groups.sort(key=lambda group: group["amount"], reverse=True)
     else:
+        groups.sort(key=lambda group: group["key"])
+
+    rangeReport = {"start": start, "end": end, "groupBy": groupBy, "groups": groups,
+                   "count": sum(group["count"] for group in groups), "amount": amount}
+
+    return rangeReport
+
+
+# Get the display name of a range report group key
+def getRangeGroupName(key, groupBy):
+    if groupBy == "week":
+        return f"Week of {key.isoformat()}"
+    elif groupBy == "month":
+        return f"{calendar.month_abbr[key.month]} {key.year}"
+    elif groupBy == "quarter":
+        return f"Q{(key.month - 1) // 3 + 1} {key.year}"
+    elif groupBy == "day":
+        return key.isoformat()
+    else:
+        return key
+
+
+# Year reports served through the report cache (report name -> function called with (userID, year))
+CACHED_REPORTS = {
+    "budgets": generateBudgetsReport,
+    "monthly": generateMonthlyReport,
+    "spendingtrends": generateSpendingTrendsReport,
+    "payers": generatePayersReport
+}
+
+
+# Get and return one of the users year reports from the report cache, only generating it when a write changed the users data for that year since it was cached
+# Closed years stay cached until a write touches them (or they're evicted), the current year is also regenerated after REPORT_CACHE_TTL seconds
+# Note: cached reports are shared between requests, so callers must not modify them
+def getCachedReport(report, userID, year=None):
+    if not year:
+        year = datetime.now().year
+
+    key = (userID, report, year)
+    versions = tendie_cache.getReportVersion(userID, year)
+
+    # Entries are (versions, time generated, report): one entry per report and year, replaced when it's regenerated (reports that are None, e.g. no budgets, are cached too)
+    entry = tendie_cache.reportCache.get(key)
+    if entry is not None and entry[0] == versions and (year < datetime.now().year or time.monotonic() - entry[1] < tendie_cache.REPORT_CACHE_TTL):
+        return entry[2]
+
+    # Use the report worker's result for the current versions, falling back to generating it here when the worker hasn't got to it yet
+    entry = getPrecomputedEntry(report, userID, year, versions)
+    if entry is None:
+        entry = (versions, time.monotonic(), CACHED_REPORTS[report](userID, year))
+
+    tendie_cache.reportCache.set(key, entry)
+
+    return entry[2]
+
+
+# Shape of the stored reports: bump it whenever a cached report's structure changes (2: the monthly report's table is paged from /expensehistory/data) so results stored in an older shape are never served
+REPORT_RESULTS_FORMAT = 2
+
+
+# Get a report precomputed by the report worker for the users (report version, year version) as a report cache entry (None if there's no result for those versions in the current format)
+def getPrecomputedEntry(report, userID, year, versions):
+    row = db.execute(
+        "SELECT result->'report' FROM reportresults WHERE user_id = :usersID AND report = :report AND year = :year AND reportversion = :reportVersion AND yearversion = :yearVersion AND result->>'format' = :format",
+        {"usersID": userID, "report": report, "year": year, "reportVersion": versions[0], "yearVersion": versions[1], "format": str(REPORT_RESULTS_FORMAT)}).fetchone()
+    if row is None:
         return None
+
+    # JSONB results come back already decoded (dates are ISO strings, which the report templates print the same way)
+    return (versions, time.monotonic(), row[0])
+
+
+# Generate every cached report of the users year and store the results (as JSON, tagged with REPORT_RESULTS_FORMAT) for the users current versions (replacing older results). Doesn't commit
+# Call it in a REPEATABLE READ transaction so the versions and the reports come from the same snapshot
+def precomputeReports(userID, year):
+    reportVersion, yearVersion = tendie_cache.getReportVersion(userID, year)
+    for report, generate in CACHED_REPORTS.items():
+        result = json.dumps({"format": REPORT_RESULTS_FORMAT, "report": generate(userID, year)}, default=encodeReportValue)
+        db.execute(
+            "INSERT INTO reportresults (user_id, report, year, reportversion, yearversion, result) VALUES (:usersID, :report, :year, :reportVersion, :yearVersion, CAST(:result AS JSONB)) ON CONFLICT (user_id, report, year) DO UPDATE SET reportversion = EXCLUDED.reportversion, yearversion = EXCLUDED.yearversion, result = EXCLUDED.result, computedtime = now()",
+            {"usersID": userID, "report": report, "year": year, "reportVersion": reportVersion, "yearVersion": yearVersion, "result": result})
+
+    return len(CACHED_REPORTS)
+
+
+# Encode the values json can't (the dates in report rows) when storing precomputed reports
+def encodeReportValue(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+
+    raise TypeError(f"{type(value).__name__} isn't JSON serializable")
@@ -0,0 +1,66 @@
+import logging
+import os
+import time
+import tendie_reports
+
+from helpers import convertSQLToDict
+from tendie_db import db
+
+# Number of (user, year) jobs claimed per pass, and seconds the worker sleeps when the queue is empty
+REPORT_WORKER_BATCH_SIZE = int(os.getenv("REPORT_WORKER_BATCH_SIZE", 20))
+REPORT_WORKER_INTERVAL = int(os.getenv("REPORT_WORKER_INTERVAL", 2))
+
+# Seconds after which a claimed job that wasn't finished (e.g. the worker died) can be claimed again
+REPORT_JOB_CLAIM_SECONDS = 600
+
+logger = logging.getLogger(__name__)
+
+
+# Claim up to 'limit' queued (user, year) jobs, oldest first, and commit the claim so writes queueing the same job don't wait on the worker
+# Several workers can run at once: SKIP LOCKED keeps them from claiming the same jobs
+def claimReportJobs(limit):
+    results = db.execute(
+        "UPDATE reportjobs SET claimedtime = clock_timestamp() WHERE (user_id, year) IN (SELECT user_id, year FROM reportjobs WHERE claimedtime IS NULL OR claimedtime < clock_timestamp() - make_interval(secs => :claimSeconds) ORDER BY requestedtime LIMIT :limit FOR UPDATE SKIP LOCKED) RETURNING user_id, year, requestedtime",
+        {"limit": limit, "claimSeconds": REPORT_JOB_CLAIM_SECONDS}).fetchall()
+    db.commit()
+
+    return convertSQLToDict(results)
+
+
+# Recompute the reports of one pass of claimed jobs and return the number of jobs done
+# A job requeued by a write while it was being recomputed keeps its row (its requestedtime changed) so the newer data gets its own recompute
+def runReportJobs(limit=REPORT_WORKER_BATCH_SIZE):
+    done = 0
+    for job in claimReportJobs(limit):
+        try:
+            # Run the job in a REPEATABLE READ transaction (set through the connection: a SET TRANSACTION statement fails once the pools pre-ping has run its query)
+            db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            tendie_reports.precomputeReports(job["user_id"], job["year"])
+            db.execute("DELETE FROM reportjobs WHERE user_id = :usersID AND year = :year AND requestedtime = :requestedTime",
+                       {"usersID": job["user_id"], "year": job["year"], "requestedTime": job["requestedtime"]})
+            db.commit()
+            done += 1
+        except Exception:
+            db.rollback()
+            logger.exception("Report job for user %s year %s failed", job["user_id"], job["year"])
+
+    return done
+
+
+# Work the report job queue until stopped (or until it's empty with once=True) and return the number of jobs done
+def runWorker(once=False):
+    done = 0
+    while True:
+        try:
+            count = runReportJobs()
+        except Exception:
+            logger.exception("Report worker failed")
+            count = 0
+        finally:
+            db.remove()
+        done += count
+
+        if not count:
+            if once:
+                return done
+            time.sleep(REPORT_WORKER_INTERVAL)
@@ -0,0 +1,174 @@
+import tendie_cache
+
+from datetime import date, timedelta
+from helpers import convertSQLToDict
+from tendie_db import db
+
+
+# Rollup key note: every expense is counted in exactly one (user, calendar year, month, ISO week, category, payer) row of the spendingrollup table
+# Functions that change expenses call into this module *before* committing so the rollup changes in the same transaction
+
+
+# Add (sign=1) or subtract (sign=-1) the users expenses matching the WHERE clause to/from the rollup
+# Call with sign=1 after inserting/updating expenses and with sign=-1 before updating/deleting them
+def applyExpenses(userID, where, params, sign=1):
+    queryParams = {"usersID": userID, "sign": sign}
+    queryParams.update(params)
+
+    # Also bumps the users version of every year the expenses are in (same statement), which invalidates the cached reports of those years only, and queues those years for the report worker
+    queueJobs = f"INSERT INTO reportjobs (user_id, year) SELECT :usersID, year FROM versions {tendie_cache.REPORT_JOB_UPSERT}" if tendie_cache.REPORT_WORKER else "SELECT 1"
+    db.execute(
+        f"WITH changed AS (INSERT INTO spendingrollup (user_id, year, month, week, category, payer, count, amount) SELECT user_id, date_part('year', expensedate), date_part('month', expensedate), date_part('week', expensedate), category, payer, :sign * COUNT(*), :sign * SUM(amount::float8) FROM expenses WHERE user_id = :usersID AND ({where}) GROUP BY user_id, date_part('year', expensedate), date_part('month', expensedate), date_part('week', expensedate), category, payer ON CONFLICT (user_id, year, month, week, category, payer) DO UPDATE SET count = spendingrollup.count + EXCLUDED.count, amount = spendingrollup.amount + EXCLUDED.amount RETURNING year), versions AS (INSERT INTO useryearversions (user_id, year, version) SELECT DISTINCT :usersID, year, 1 FROM changed ON CONFLICT (user_id, year) DO UPDATE SET version = useryearversions.version + 1 RETURNING year) {queueJobs}",
+        queryParams)
+
+    # Drop rows that no longer have any expenses so reads don't report empty categories/payers
+    if sign < 0:
+        db.execute("DELETE FROM spendingrollup WHERE user_id = :usersID AND count <= 0", {"usersID": userID})
+
+
+# Add expenses (by ID) to the rollup
+def addExpenses(expenseIDs, userID):
+    if expenseIDs:
+        applyExpenses(userID, "id = ANY(:expenseIDs)", {"expenseIDs": list(expenseIDs)}, 1)
+
+
+# Remove expenses (by ID) from the rollup
+def removeExpenses(expenseIDs, userID):
+    if expenseIDs:
+        applyExpenses(userID, "id = ANY(:expenseIDs)", {"expenseIDs": list(expenseIDs)}, -1)
+
+
+# Move the rollup rows of one category or payer to a new name (used for category and payer renaming). Works on the rollup only, so it's as cheap as the users number of rollup rows
+def renameKey(column, oldName, newName, userID):
+    if column not in ("category", "payer"):
+        raise ValueError(f"Can't rename rollup column '{column}'")
+
+    if oldName == newName:
+        return
+
+    # Merge into any rows that already use the new name (e.g. an inactive category that's still on old expenses)
+    otherColumn = "payer" if column == "category" else "category"
+    db.execute(
+        f"INSERT INTO spendingrollup (user_id, year, month, week, {column}, {otherColumn}, count, amount) SELECT user_id, year, month, week, :newName, {otherColumn}, count, amount FROM spendingrollup WHERE user_id = :usersID AND {column} = :oldName ON CONFLICT (user_id, year, month, week, category, payer) DO UPDATE SET count = spendingrollup.count + EXCLUDED.count, amount = spendingrollup.amount + EXCLUDED.amount",
+        {"usersID": userID, "oldName": oldName, "newName": newName})
+    db.execute(f"DELETE FROM spendingrollup WHERE user_id = :usersID AND {column} = :oldName",
+               {"usersID": userID, "oldName": oldName})
+
+    # A rename can touch every year, so invalidate all of the users cached reports
+    tendie_cache.bumpReportVersion(userID)
+
+
+# Get the Monday a (year, month, ISO week) rollup key belongs to
+def getWeekStart(year, month, week):
+    # Early January days can be in the last ISO week of the previous year, and late December days in week 1 of the next year
+    isoYear = year
+    if month == 12 and week == 1:
+        isoYear = year + 1
+    elif month == 1 and week >= 52:
+        isoYear = year - 1
+
+    return date.fromisocalendar(isoYear, week, 1)
+
+
+# SQL (and params) that sums the users rollup by (year, month, ISO week) for the weeks starting on weekStart thru weekEnd (exclusive). Sum the results per week with sumWeeklyTotals
+def getWeeklyTotalsSQL(weekStart, weekEnd):
+    lastDay = weekEnd - timedelta(days=1)
+
+    return ("SELECT year, month, week, SUM(amount) AS amount FROM spendingrollup WHERE user_id = :usersID AND (year, month) >= (:weeksStartYear, :weeksStartMonth) AND (year, month) <= (:weeksEndYear, :weeksEndMonth) GROUP BY year, month, week",
+            {"weeksStartYear": weekStart.year, "weeksStartMonth": weekStart.month, "weeksEndYear": lastDay.year, "weeksEndMonth": lastDay.month})
+
+
+# Sum (year, month, ISO week) rollup totals into a dict of totals keyed by the Monday of each week between weekStart and weekEnd (exclusive)
+def sumWeeklyTotals(records, weekStart, weekEnd):
+    weeklyTotals = {}
+    for record in records:
+        startOfWeek = getWeekStart(record["year"], record["month"], record["week"])
+        if weekStart <= startOfWeek < weekEnd:
+            weeklyTotals[startOfWeek] = weeklyTotals.get(startOfWeek, 0) + record["amount"]
+
+    return weeklyTotals
+
+
+# Get and return the users total spend for the weeks starting on weekStart thru weekEnd (exclusive), keyed by the Monday of each week
+def getWeeklyTotals(weekStart, weekEnd, userID):
+    query, params = getWeeklyTotalsSQL(weekStart, weekEnd)
+    params["usersID"] = userID
+    results = db.execute(query, params).fetchall()
+
+    return sumWeeklyTotals(convertSQLToDict(results), weekStart, weekEnd)
+
+
+# Groupings supported by getRangeTotals: the group key as computed from a rollup row and from an expense (None: the rollup can't group by it, so only expenses are read)
+# Week keys are the Monday of the ISO week (the rollup's ISO year is derived the same way as getWeekStart), month/quarter keys the first day of the month/quarter
+RANGE_GROUPS = {
+    "day": (None, "expensedate"),
+    "week": ("to_date((CASE WHEN month = 12 AND week = 1 THEN year + 1 WHEN month = 1 AND week >= 52 THEN year - 1 ELSE year END)::text || lpad(week::text, 2, '0'), 'IYYYIW')",
+             "date_trunc('week', expensedate)::date"),
+    "month": ("make_date(year, month, 1)", "date_trunc('month', expensedate)::date"),
+    "quarter": ("make_date(year, (month - 1) / 3 * 3 + 1, 1)", "date_trunc('quarter', expensedate)::date"),
+    "category": ("category", "category"),
+    "payer": ("payer", "payer")
+}
+
+
+# Get and return the users total amount and count of expenses dated start thru end (exclusive) per group (see RANGE_GROUPS), as {key: {"count", "amount"}}
+# Query note: whole calendar months inside the range are read from the rollup, only the partial months at either end are read from expenses (a (user_id, expensedate) index range scan),
+# so a quarter-to-date or trailing 90 day range costs about the same as a year. Grouping by day reads the range from expenses
+def getRangeTotals(userID, start, end, groupBy):
+    if groupBy not in RANGE_GROUPS:
+        raise ValueError(f"Can't group expenses by '{groupBy}'")
+    rollupKey, expenseKey = RANGE_GROUPS[groupBy]
+
+    # Whole months: from the first month that starts on/after start up to the month end is in
+    monthsStart = start if start.day == 1 else (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+    monthsEnd = end.replace(day=1)
+    if rollupKey is None or monthsStart >= monthsEnd:
+        monthsStart = monthsEnd = end
+
+    params = {"usersID": userID, "start": start, "end": end, "monthsStart": monthsStart, "monthsEnd": monthsEnd,
+              "monthsStartYear": monthsStart.year, "monthsStartMonth": monthsStart.month, "monthsEndYear": monthsEnd.year, "monthsEndMonth": monthsEnd.month}
+
+    rollupSQL = ""
+    if monthsStart < monthsEnd:
+        rollupSQL = f"SELECT {rollupKey} AS key, count, amount FROM spendingrollup WHERE user_id = :usersID AND (year, month) >= (:monthsStartYear, :monthsStartMonth) AND (year, month) < (:monthsEndYear, :monthsEndMonth) UNION ALL "
+
+    results = db.execute(
+        f"SELECT key, SUM(count)::integer AS count, SUM(amount) AS amount FROM ({rollupSQL}SELECT {expenseKey} AS key, 1 AS count, amount::float8 AS amount FROM expenses WHERE user_id = :usersID AND ((expensedate >= :start AND expensedate < :monthsStart) OR (expensedate >= :monthsEnd AND expensedate < :end))) AS totals GROUP BY key",
+        params).fetchall()
+
+    return {key: {"count": count, "amount": amount} for key, count, amount in results}
+
+
+# Aggregate the expenses table the same way the rollup is keyed (optionally for a single user)
+def _freshRollupSQL(userID):
+    userFilter = "user_id = :usersID" if userID else "user_id IS NOT NULL"
+
+    return f"SELECT user_id, date_part('year', expensedate)::integer AS year, date_part('month', expensedate)::integer AS month, date_part('week', expensedate)::integer AS week, category, payer, COUNT(*)::integer AS count, SUM(amount::float8) AS amount FROM expenses WHERE {userFilter} GROUP BY user_id, date_part('year', expensedate), date_part('month', expensedate), date_part('week', expensedate), category, payer"
+
+
+# Compare the rollup with a fresh aggregate of the expenses table and return the rows that have drifted
+def checkDrift(userID=None):
+    userFilter = "WHERE user_id = :usersID" if userID else ""
+    results = db.execute(
+        f"SELECT user_id, year, month, week, category, payer, fresh.count AS expectedcount, rollup.count AS rollupcount, fresh.amount AS expectedamount, rollup.amount AS rollupamount FROM ({_freshRollupSQL(userID)}) AS fresh FULL OUTER JOIN (SELECT * FROM spendingrollup {userFilter}) AS rollup USING (user_id, year, month, week, category, payer) WHERE fresh.count IS DISTINCT FROM rollup.count OR abs(COALESCE(fresh.amount, 0) - COALESCE(rollup.amount, 0)) > 0.005 ORDER BY user_id, year, month, week, category, payer",
+        {"usersID": userID}).fetchall()
+
+    return convertSQLToDict(results)
+
+
+# Recompute the rollup from scratch (optionally for a single user) and return the number of rollup rows written
+def rebuild(userID=None):
+    userFilter = "WHERE user_id = :usersID" if userID else ""
+
+    # Block concurrent expense writes from changing the rollup while it's being recomputed (they wait, then apply their changes on top)
+    db.execute("LOCK TABLE spendingrollup IN EXCLUSIVE MODE")
+    db.execute(f"DELETE FROM spendingrollup {userFilter}", {"usersID": userID})
+    rows = db.execute(
+        f"INSERT INTO spendingrollup (user_id, year, month, week, category, payer, count, amount) {_freshRollupSQL(userID)}",
+        {"usersID": userID}).rowcount
+
+    # Invalidate every cached dashboard and report of the rebuilt users
+    db.execute(f"UPDATE users SET dataversion = dataversion + 1, reportversion = reportversion + 1 {userFilter.replace('user_id', 'id')}", {"usersID": userID})
+    db.commit()
+
+    return rows
@@ -0,0 +1,70 @@
+import re
+import tendie_expenses
+
+from datetime import date
+from helpers import convertSQLToDict
+from tendie_db import db
+
+# Max number of results returned for one page of a search
+SEARCH_MAX_PAGE_SIZE = 50
+
+
+# Search the users expense descriptions and return one page of results ranked by relevance
+# Query syntax: words match whole words, "quoted words" match a phrase, word* matches a prefix. With fuzzy on, descriptions similar to the query (e.g. typos) also match
+# Query note: both kinds of match are answered from (user_id, ...) GIN indexes (see migrations/0006_expense_search.sql)
+def searchExpenses(args, userID):
+    tsquery, text = parseSearchQuery(args.get("q", ""))
+    page = max(int(args.get("page", 1)), 1)
+    length = int(args.get("length", 20))
+    if length < 1 or length > SEARCH_MAX_PAGE_SIZE:
+        length = SEARCH_MAX_PAGE_SIZE
+    fuzzy = args.get("fuzzy", "true").lower() in ("1", "true", "yes")
+
+    search = {"query": args.get("q", ""), "page": page, "results": [], "hasMore": False}
+    if not tsquery:
+        return search
+
+    # Filters (year, category, payer)
+    filters = tendie_expenses.getExpenseFilters(args)
+    if args.get("year"):
+        year = int(args.get("year"))
+        filters["startDate"] = date(year, 1, 1)
+        filters["endDate"] = date(year, 12, 31)
+    where, params = tendie_expenses.getExpenseFilterSQL(filters, userID)
+
+    match = "to_tsvector('simple', description) @@ query"
+    if fuzzy:
+        match = f"({match} OR :text <% description)"
+
+    # Fetch one extra row to know if there's another page without counting every match
+    params.update({"tsquery": tsquery, "text": text, "limit": length + 1, "offset": (page - 1) * length})
+    results = db.execute(f"SELECT id, description, category, expensedate AS date, payer, amount, version, ts_rank(to_tsvector('simple', description), query) + word_similarity(:text, description) AS rank FROM expenses, to_tsquery('simple', :tsquery) AS query WHERE {where} AND {match} ORDER BY rank DESC, id DESC LIMIT :limit OFFSET :offset",
+                         params).fetchall()
+
+    results = convertSQLToDict(results)
+    for result in results:
+        result["date"] = str(result["date"])
+    search["hasMore"] = len(results) > length
+    search["results"] = results[:length]
+
+    return search
+
+
+# Parse a search query into a Postgres tsquery string and the plain text of the query (for fuzzy matching)
+# Only word characters are kept from each term so user input can't inject tsquery operators
+def parseSearchQuery(query):
+    terms = []
+    words = []
+
+    for phrase, term in re.findall(r'"([^"]*)"|(\S+)', query):
+        lexemes = re.findall(r"\w+", (phrase or term).lower())
+        if not lexemes:
+            continue
+        words.extend(lexemes)
+
+        # Terms with punctuation inside (e.g. 'uber-eats') are matched as a phrase of their words, same as quoted phrases
+        if term.endswith("*"):
+            lexemes[-1] += ":*"
+        terms.append("(" + " <-> ".join(lexemes) + ")")
+
+    return " & ".join(terms), " ".join(words)
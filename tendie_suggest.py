@@ -0,0 +1,171 @@
+import bisect
+import os
+import re
+import threading
+import time
+import tendie_cache
+
+from tendie_db import db
+
+# Max age (seconds) of a users model before it's rebuilt from the DB (picks up changes made through other worker processes)
+SUGGEST_MODEL_MAX_AGE = int(os.getenv("SUGGEST_MODEL_MAX_AGE", 3600))
+
+# Max number of the users most recent expenses a model is built from (bounds the scan when a model isn't cached)
+SUGGEST_MODEL_EXPENSES = int(os.getenv("SUGGEST_MODEL_EXPENSES", 5000))
+
+# Max number of tokens a partly typed word (the last word of the description) is expanded to
+MAX_PREFIX_MATCHES = 20
+
+# Approximate bytes a model uses per token (its dict entry and count dicts) and per category/payer counted for a token, on top of the strings themselves
+MODEL_TOKEN_BYTES = 250
+MODEL_COUNT_BYTES = 50
+
+# Per user description models, keyed by user ID (LRU evicted by the size each model keeps track of, so learnExpenses doesn't re-measure them)
+modelCache = tendie_cache.registerCache(tendie_cache.LRUCache("suggest", int(os.getenv("SUGGEST_CACHE_BYTES", 16 * 1024 * 1024))))
+
+# Serializes in-place updates of cached models (learn/unlearn run in the request threads of this worker)
+_modelLock = threading.Lock()
+
+
+# A users description model: for each description token, how often expenses with that token used each category and payer
+# tokens: {token: [{category: count}, {payer: count}]}, sortedTokens: the tokens in order (for prefix matching while the user is typing)
+# size: approximate bytes used, kept up to date as expenses are learnt/unlearnt so the model cache never has to measure it
+class DescriptionModel:
+    __slots__ = ("tokens", "sortedTokens", "built", "size")
+
+    def __init__(self):
+        self.tokens = {}
+        self.sortedTokens = []
+        self.built = time.time()
+        self.size = 0
+
+    # Add (count=1) or remove (count=-1) one expense
+    def learn(self, description, category, payer, count=1):
+        for token in tokenize(description):
+            counts = self.tokens.get(token)
+            if counts is None:
+                if count < 0:
+                    continue
+                counts = self.tokens[token] = [{}, {}]
+                bisect.insort(self.sortedTokens, token)
+                self.size += len(token) + MODEL_TOKEN_BYTES
+            for index, value in ((0, category), (1, payer)):
+                if value not in counts[index]:
+                    self.size += len(value) + MODEL_COUNT_BYTES
+                counts[index][value] = counts[index].get(value, 0) + count
+                if counts[index][value] <= 0:
+                    del counts[index][value]
+                    self.size -= len(value) + MODEL_COUNT_BYTES
+            if not counts[0]:
+                del self.tokens[token]
+                self.sortedTokens.pop(bisect.bisect_left(self.sortedTokens, token))
+                self.size -= len(token) + MODEL_TOKEN_BYTES + sum(len(value) + MODEL_COUNT_BYTES for value in counts[1])
+
+    # Work out the size of a model built all at once (learn keeps it up to date from then on)
+    def measure(self):
+        self.size = sum(len(token) + MODEL_TOKEN_BYTES + sum(len(value) + MODEL_COUNT_BYTES for index in (0, 1) for value in counts[index])
+                        for token, counts in self.tokens.items())
+
+
+# Split a description into lowercase word tokens. Same rules as the SQL in buildModel: letters/digits only, 2+ characters, not just digits
+def tokenize(description, keepPartial=False):
+    tokens = re.findall(r"[^\W_]+", (description or "").lower())
+    if keepPartial:
+        return tokens
+
+    return [token for token in tokens if len(token) > 1 and not token.isdigit()]
+
+
+# Build the users model from their expenses. The DB does the tokenizing/counting so only one row per (token, category, payer) comes back
+# Only the users current categories and payers are learnt (old expenses can still use categories/payers the user has since deleted)
+# Query note: only the users most recent SUGGEST_MODEL_EXPENSES expenses are read (a backwards range scan of the (user_id, expensedate, id) index), so building a model on a cache miss costs the same however long the users history is
+def buildModel(userID):
+    results = db.execute("SELECT token, category, payer, COUNT(*) AS count FROM (SELECT description, category, payer FROM expenses WHERE user_id = :usersID ORDER BY expensedate DESC, id DESC LIMIT :limit) AS recent, regexp_split_to_table(lower(description), '[^[:alnum:]]+') AS token WHERE length(token) > 1 AND token !~ '^[0-9]+$' AND category IN (SELECT categories.name FROM usercategories INNER JOIN categories ON usercategories.category_id = categories.id WHERE usercategories.user_id = :usersID) AND (payer = 'Self' OR payer IN (SELECT name FROM payers WHERE user_id = :usersID)) GROUP BY token, category, payer",
+                         {"usersID": userID, "limit": SUGGEST_MODEL_EXPENSES}).fetchall()
+
+    model = DescriptionModel()
+    for token, category, payer, count in results:
+        counts = model.tokens.setdefault(token, [{}, {}])
+        counts[0][category] = counts[0].get(category, 0) + count
+        counts[1][payer] = counts[1].get(payer, 0) + count
+    model.sortedTokens = sorted(model.tokens)
+    model.measure()
+
+    return model
+
+
+# Get the users cached model (building it on a miss or when it's too old)
+def getModel(userID):
+    model = modelCache.get(userID)
+    if model is None or time.time() - model.built > SUGGEST_MODEL_MAX_AGE:
+        model = buildModel(userID)
+        modelCache.set(userID, model, model.size)
+
+    return model
+
+
+# Suggest a category and payer for a (partly typed) description. Each token votes for the categories/payers used with it, weighted by how often, and a partly typed last word votes through the tokens it's a prefix of
+def suggest(description, userID):
+    suggestion = {"category": None, "payer": None, "confidence": 0}
+
+    words = tokenize(description, keepPartial=True)
+    if not words:
+        return suggestion
+
+    model = getModel(userID)
+    with _modelLock:
+        tokens = [word for word in words[:-1] if word in model.tokens]
+        lastWord = words[-1]
+        if lastWord in model.tokens:
+            tokens.append(lastWord)
+        else:
+            start = bisect.bisect_left(model.sortedTokens, lastWord)
+            for token in model.sortedTokens[start:start + MAX_PREFIX_MATCHES]:
+                if not token.startswith(lastWord):
+                    break
+                tokens.append(token)
+
+        if not tokens:
+            return suggestion
+
+        votes = [{}, {}]
+        for token in tokens:
+            for index in (0, 1):
+                counts = model.tokens[token][index]
+                total = sum(counts.values())
+                for value, count in counts.items():
+                    votes[index][value] = votes[index].get(value, 0) + count / total
+
+    for index, key in ((0, "category"), (1, "payer")):
+        if votes[index]:
+            best = max(votes[index], key=votes[index].get)
+            suggestion[key] = best
+            if index == 0:
+                suggestion["confidence"] = round(votes[index][best] / sum(votes[index].values()), 2)
+
+    return suggestion
+
+
+# Add expenses to the users cached model (if it's cached), e.g. after they're added. Expenses are dicts with description/category/payer
+def learnExpenses(expenses, userID, count=1):
+    model = modelCache.peek(userID)
+    if model is None:
+        return
+
+    with _modelLock:
+        for expense in expenses:
+            model.learn(expense["description"], expense["category"], expense["payer"], count)
+        size = model.size
+
+    # Keep the caches byte count right now that the model changed size (the model tracks its own size, so nothing is measured here)
+    modelCache.resize(userID, model, size)
+
+
+# Remove expenses from the users cached model (if it's cached), e.g. before they're updated/deleted
+def unlearnExpenses(expenses, userID):
+    learnExpenses(expenses, userID, -1)
+
+
+# Drop the users cached model so it's rebuilt on the next suggestion (for changes too big to apply one expense at a time, e.g. imports and bulk edits)
+def forgetModel(userID):
+    modelCache.removeWhere(lambda key: key == userID)